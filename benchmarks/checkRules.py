@@ -0,0 +1,198 @@
+"""Check that VariableRulesWriter's condition set merging keeps the rules'
+meaning.
+
+    python benchmarks/checkRules.py --count 400 --seed 0
+
+Generates random designspace rules on two axes, with overlapping, touching
+and repeated condition sets and shared, chained and cancelling
+substitutions, and runs the writer on them. At every location of a grid
+made of the condition ranges' bounds and the midpoints between them, the
+glyph each glyph becomes is computed twice under feaLib's first-match
+semantics: from the records the rules make unmerged (one per distinct
+condition set, in order of first appearance, applying one lookup per rule)
+and from the writer's conditionset statements and rvrn blocks. Any
+difference is printed, and the exit status is 1.
+
+The axes have no maps, so design and userspace coordinates coincide.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from fontTools.designspaceLib import (  # noqa: E402
+    AxisDescriptor,
+    DesignSpaceDocument,
+    RuleDescriptor,
+)
+from fontTools.feaLib import ast  # noqa: E402
+
+from featureWriters.VariableRulesWriter import VariableRulesWriter  # noqa: E402
+
+AXES = [("Weight", "wght", 100, 400, 900), ("Width", "wdth", 50, 100, 150)]
+GLYPHS = ["a", "b", "c", "d", "e", "f"]
+
+
+def randomRange(rng, minimum, maximum):
+    # a few distinct values, so that ranges often overlap or touch
+    values = [minimum + (maximum - minimum) * i // 4 for i in range(5)]
+    low, high = sorted(rng.sample(values, 2))
+    return (
+        None if rng.random() < 0.1 else low,
+        None if rng.random() < 0.1 else high,
+    )
+
+
+def randomSubs(rng, previous):
+    if previous and rng.random() < 0.4:
+        return list(rng.choice(previous))
+    sources = rng.sample(GLYPHS, rng.randint(1, 3))
+    return [(source, rng.choice(GLYPHS)) for source in sources]
+
+
+def randomDesignspace(rng):
+    ds = DesignSpaceDocument()
+    for name, tag, minimum, default, maximum in AXES:
+        axis = AxisDescriptor()
+        axis.name, axis.tag = name, tag
+        axis.minimum, axis.default, axis.maximum = minimum, default, maximum
+        ds.addAxis(axis)
+    conditionSets = []
+    subs = []
+    for i in range(rng.randint(1, 8)):
+        rule = RuleDescriptor()
+        rule.name = "rule%d" % i
+        for _ in range(rng.randint(1, 2)):
+            if conditionSets and rng.random() < 0.3:
+                conditionSet = rng.choice(conditionSets)
+            else:
+                conditionSet = []
+                for name, _, minimum, _, maximum in rng.sample(
+                    AXES, rng.randint(1, len(AXES))
+                ):
+                    low, high = randomRange(rng, minimum, maximum)
+                    conditionSet.append(dict(name=name, minimum=low, maximum=high))
+                conditionSets.append(conditionSet)
+            rule.conditionSets.append(conditionSet)
+        rule.subs = randomSubs(rng, subs)
+        subs.append(rule.subs)
+        ds.addRule(rule)
+    return ds
+
+
+def matches(box, location):
+    for tag, (minimum, maximum) in box.items():
+        value = location[tag]
+        if minimum is not None and value < minimum:
+            return False
+        if maximum is not None and value > maximum:
+            return False
+    return True
+
+
+def apply(records, location, glyph):
+    """Return what glyph becomes at location: the lookups of the first
+    record whose box matches are applied in order."""
+    for box, lookups in records:
+        if matches(box, location):
+            for lookup in lookups:
+                glyph = lookup.get(glyph, glyph)
+            return glyph
+    return glyph
+
+
+def _lookup(subs):
+    mapping = {}
+    for source, target in subs:
+        mapping.setdefault(source, target)
+    return mapping
+
+
+def unmergedRecords(ds):
+    tags = {axis.name: axis.tag for axis in ds.axes}
+    records = {}
+    for rule in ds.rules:
+        for conditionSet in rule.conditionSets:
+            box = {
+                tags[c["name"]]: (c["minimum"], c["maximum"]) for c in conditionSet
+            }
+            key = tuple(sorted(box.items()))
+            records.setdefault(key, (box, []))[1].append(_lookup(rule.subs))
+    return list(records.values())
+
+
+def writtenRecords(feaFile):
+    boxes = {}
+    records = {}
+    for statement in feaFile.statements:
+        if isinstance(statement, ast.ConditionsetStatement):
+            boxes[statement.name] = statement.conditions
+        elif isinstance(statement, ast.VariationBlock):
+            name = statement.conditionset
+            subs = [
+                (s.glyphs[0].glyph, s.replacements[0].glyph)
+                for s in statement.statements
+            ]
+            records.setdefault(name, (boxes[name], []))[1].append(_lookup(subs))
+    return list(records.values())
+
+
+def grid(ds, records):
+    axes = []
+    for axis in ds.axes:
+        values = {axis.minimum, axis.maximum}
+        for box, _ in records:
+            values.update(v for v in box.get(axis.tag, ()) if v is not None)
+        values = sorted(values)
+        values += [(a + b) / 2 for a, b in zip(values, values[1:])]
+        axes.append([(axis.tag, value) for value in sorted(values)])
+    return [dict(location) for location in itertools.product(*axes)]
+
+
+def check(ds):
+    """Return the (location, glyph, expected, got) differences between the
+    unmerged rules and the writer's output."""
+    feaFile = ast.FeatureFile()
+    VariableRulesWriter().write(ds, feaFile)
+    before = unmergedRecords(ds)
+    after = writtenRecords(feaFile)
+    differences = []
+    for location in grid(ds, before):
+        for glyph in GLYPHS:
+            expected = apply(before, location, glyph)
+            got = apply(after, location, glyph)
+            if expected != got:
+                differences.append((location, glyph, expected, got))
+    return differences
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--count", type=int, default=400, help="Number of rule sets to check"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    rng = random.Random(args.seed)
+    failures = 0
+    for i in range(args.count):
+        ds = randomDesignspace(rng)
+        differences = check(ds)
+        if differences:
+            failures += 1
+            location, glyph, expected, got = differences[0]
+            print(
+                "rule set %d: %s at %s becomes %s, expected %s (%d differences)"
+                % (i, glyph, location, got, expected, len(differences))
+            )
+    print("%d of %d rule sets differ" % (failures, args.count))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
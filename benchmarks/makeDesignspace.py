@@ -0,0 +1,219 @@
+"""Generate a synthetic designspace for benchmarking the feature writers.
+
+    python benchmarks/makeDesignspace.py OUTDIR --masters 12 --axes 2 \
+        --glyphs 2000 --kern-pairs 40000 --anchors 2 --rules 50
+
+The generated family has the requested number of masters spread over the
+axes (the default, the axis extremes, then pseudo-random intermediates),
+base and mark glyphs with anchors that vary in some masters and not in
+others, kerning groups and a mix of class/class, class/glyph and
+glyph/glyph kern pairs (some constant, some zero, some sparse), and
+designspace rules substituting glyphs for alternates over weight ranges.
+The same parameters and seed always produce the same designspace.
+"""
+import argparse
+import os
+import random
+
+import ufoLib2
+from fontTools.designspaceLib import (
+    AxisDescriptor,
+    DesignSpaceDocument,
+    RuleDescriptor,
+    SourceDescriptor,
+)
+
+AXIS_TAGS = ["wght", "wdth", "opsz", "slnt", "GRAD", "XTRA", "YOPQ", "XOPQ"]
+MARK_ANCHORS = ["top", "bottom", "center", "ogonek"]
+GROUP_SIZE = 8
+
+
+def masterLocations(axes, count, rng):
+    locations = [{axis.name: axis.default for axis in axes}]
+    for axis in axes:
+        for value in (axis.minimum, axis.maximum):
+            if len(locations) >= count:
+                return locations
+            if value == axis.default:
+                continue
+            location = {a.name: a.default for a in axes}
+            location[axis.name] = value
+            locations.append(location)
+    while len(locations) < count:
+        location = {
+            axis.name: rng.randint(axis.minimum, axis.maximum) for axis in axes
+        }
+        if location not in locations:
+            locations.append(location)
+    return locations
+
+
+def _pairCounts(total, capacities):
+    """Split total kern pairs evenly between kinds which can make at most
+    capacities pairs each, giving what a kind can't make to the others."""
+    if total > sum(capacities):
+        raise ValueError(
+            "can't make %d distinct kern pairs; the glyphs and groups only "
+            "allow %d" % (total, sum(capacities))
+        )
+    counts = [0] * len(capacities)
+    order = sorted(range(len(capacities)), key=capacities.__getitem__)
+    for left, kind in enumerate(order):
+        counts[kind] = min(capacities[kind], total // (len(order) - left))
+        total -= counts[kind]
+    return counts
+
+
+def _samplePairs(rng, firsts, seconds, count):
+    indices = rng.sample(range(len(firsts) * len(seconds)), count)
+    return [(firsts[i // len(seconds)], seconds[i % len(seconds)]) for i in indices]
+
+
+def makeDesignspace(
+    directory,
+    masters=4,
+    axes=1,
+    glyphs=500,
+    kernPairs=2000,
+    anchors=2,
+    rules=10,
+    seed=0,
+):
+    """Write a synthetic designspace and its UFO sources into directory and
+    return the path of the .designspace file. Raises ValueError if there
+    are too few glyphs for kernPairs distinct pairs."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    doc = DesignSpaceDocument()
+    for i in range(axes):
+        axis = AxisDescriptor()
+        axis.tag = AXIS_TAGS[i] if i < len(AXIS_TAGS) else "AX%02d" % i
+        axis.name = axis.tag
+        axis.minimum, axis.default, axis.maximum = 100, 400, 900
+        doc.addAxis(axis)
+
+    markCount = max(1, glyphs // 10)
+    bases = ["base%05d" % i for i in range(glyphs - markCount)]
+    marks = ["mark%04d" % i for i in range(markCount)]
+    alternates = ["%s.alt" % name for name in bases[: max(1, rules)]]
+    glyphOrder = bases + marks + alternates
+    anchorNames = MARK_ANCHORS[: max(1, anchors)]
+
+    groupCount = max(1, len(bases) // GROUP_SIZE)
+    groups = {}
+    for i in range(groupCount):
+        members = bases[i * GROUP_SIZE : (i + 1) * GROUP_SIZE]
+        groups["public.kern1.G%04d" % i] = members
+        groups["public.kern2.G%04d" % i] = members
+    side1 = [name for name in groups if name.startswith("public.kern1.")]
+    side2 = [name for name in groups if name.startswith("public.kern2.")]
+
+    # kern pairs: a third class/class, a third class/glyph, a third
+    # glyph/glyph; kinds with fewer possible pairs leave the rest to others
+    kinds = [(side1, side2), (side1, bases), (bases, bases)]
+    counts = _pairCounts(kernPairs, [len(a) * len(b) for a, b in kinds])
+    pairs = []
+    for (firsts, seconds), count in zip(kinds, counts):
+        pairs.extend(_samplePairs(rng, firsts, seconds, count))
+    pairs.sort()
+    # per pair: base value, per-master variation, and whether it's sparse
+    pairData = [
+        (rng.randint(-120, 40), rng.choice([0, 0, 5, 10, 20]), rng.random() < 0.1)
+        for _ in pairs
+    ]
+    anchorData = {
+        name: [(rng.randint(0, 600), rng.randint(-100, 800)) for _ in anchorNames]
+        for name in bases + marks
+    }
+
+    locations = masterLocations(doc.axes, masters, rng)
+    for index, location in enumerate(locations):
+        font = ufoLib2.Font()
+        font.info.familyName = "Benchmark"
+        font.info.styleName = "Master%d" % index
+        font.info.unitsPerEm = 1000
+        font.lib["public.glyphOrder"] = glyphOrder
+        for unicode, name in enumerate(bases + marks, start=0x4E00):
+            glyph = font.newGlyph(name)
+            glyph.width = 600
+            glyph.unicodes = [unicode]
+            isMark = name in marks
+            for anchorIndex, anchorName in enumerate(anchorNames):
+                x, y = anchorData[name][anchorIndex]
+                if anchorIndex % 2:
+                    # every other anchor varies across masters
+                    x += index * 3
+                if isMark:
+                    glyph.appendAnchor({"name": "_" + anchorName, "x": x, "y": y})
+                    if anchorIndex == 0:
+                        glyph.appendAnchor({"name": anchorName, "x": x, "y": y + 200})
+                else:
+                    glyph.appendAnchor({"name": anchorName, "x": x, "y": y})
+        for name in alternates:
+            font.newGlyph(name).width = 600
+        font.groups.update(groups)
+        for (first, second), (value, step, sparse) in zip(pairs, pairData):
+            if sparse and index != 0 and index % 2:
+                continue
+            font.kerning[first, second] = value + step * index
+        if index == 0:
+            font.features.text = (
+                "languagesystem DFLT dflt;\nlanguagesystem hani dflt;\n"
+            )
+        fileName = "Master%d.ufo" % index
+        font.save(os.path.join(directory, fileName), overwrite=True)
+
+        source = SourceDescriptor()
+        source.filename = fileName
+        source.path = os.path.join(directory, fileName)
+        source.name = "master%d" % index
+        source.location = location
+        doc.addSource(source)
+
+    firstAxis = doc.axes[0].name
+    for i in range(rules):
+        rule = RuleDescriptor()
+        rule.name = "rule%d" % i
+        minimum = rng.choice([500, 600, 700])
+        rule.conditionSets.append(
+            [dict(name=firstAxis, minimum=minimum, maximum=900)]
+        )
+        rule.subs.append((bases[i % len(bases)], alternates[i % len(alternates)]))
+        doc.addRule(rule)
+
+    path = os.path.join(directory, "Benchmark.designspace")
+    doc.write(path)
+    return path
+
+
+def addArguments(parser):
+    parser.add_argument("--masters", type=int, default=4)
+    parser.add_argument("--axes", type=int, default=1)
+    parser.add_argument("--glyphs", type=int, default=500)
+    parser.add_argument("--kern-pairs", type=int, default=2000)
+    parser.add_argument("--anchors", type=int, default=2, help="anchors per glyph")
+    parser.add_argument("--rules", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def parametersFromArgs(args):
+    return dict(
+        masters=args.masters,
+        axes=args.axes,
+        glyphs=args.glyphs,
+        kernPairs=args.kern_pairs,
+        anchors=args.anchors,
+        rules=args.rules,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("directory", help="Directory to write the designspace to")
+    addArguments(parser)
+    args = parser.parse_args()
+    try:
+        print(makeDesignspace(args.directory, **parametersFromArgs(args)))
+    except ValueError as e:
+        parser.error(str(e))
@@ -0,0 +1,159 @@
+"""Time each stage of feature generation on a synthetic designspace.
+
+    python benchmarks/run.py --masters 12 --glyphs 2000 --kern-pairs 40000 \
+        --scale 10 -o results.json
+
+Generates a designspace with makeDesignspace (multiplying the glyph, kern
+pair and rule counts by --scale), then times source loading, each feature
+writer's write() and the serialization of the feature file separately.
+Timings are the best of --repeat runs; peak memory per stage is measured
+with tracemalloc in one extra run, so tracing doesn't distort the times.
+Results are written as JSON.
+"""
+import argparse
+import functools
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import ds2varlayout  # noqa: E402
+from makeDesignspace import (  # noqa: E402
+    addArguments,
+    makeDesignspace,
+    parametersFromArgs,
+)
+
+
+class BenchmarkRun:
+    """One run of the whole pipeline over a designspace, split into stages."""
+
+    def __init__(self, path, jobs=1):
+        self.path = path
+        self.jobs = jobs
+
+    def load(self):
+        from ufo2ft.featureCompiler import parseLayoutFeatures
+
+        self.ds = ds2varlayout.loadDesignspace(self.path, jobs=self.jobs)
+        self.compiler = ds2varlayout.makeCompiler(self.ds)
+        self.writers = ds2varlayout.makeWriters(self.ds)
+        # read everything the writers will, so loading is measured in full
+        for glyph in self.compiler.glyphSet.values():
+            pass
+        for source in self.ds.sources:
+            source.font.kerning, source.font.groups
+        self.featurefile = parseLayoutFeatures(self.ds.findDefault().font)
+
+    def serialize(self):
+        from featureWriters.FeaStreamWriter import FeaStreamWriter
+
+        stream = io.StringIO()
+        feaWriter = FeaStreamWriter(stream)
+        feaWriter.writeAll(self.featurefile.statements)
+        feaWriter.finish()
+        self.outputSize = stream.tell()
+
+    def stages(self):
+        """Yield (name, callable) for each stage; the writer stages are only
+        known once the load stage has run."""
+        yield "load", self.load
+        for writer in self.writers:
+            yield type(writer).__name__, functools.partial(
+                writer.write, self.ds, self.featurefile, compiler=self.compiler
+            )
+        yield "serialize", self.serialize
+
+
+def measure(path, repeat=1, jobs=1):
+    times = {}
+    for _ in range(repeat):
+        run = BenchmarkRun(path, jobs=jobs)
+        for name, stage in run.stages():
+            start = time.perf_counter()
+            stage()
+            elapsed = time.perf_counter() - start
+            times[name] = min(times.get(name, elapsed), elapsed)
+
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for name, stage in BenchmarkRun(path, jobs=jobs).stages():
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            stage()
+            peaks[name] = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+    stages = {
+        name: {"time": times[name], "peak_memory": peaks.get(name)} for name in times
+    }
+    counts = {
+        "sources": len(run.ds.sources),
+        "glyphs": len(run.compiler.glyphSet),
+        "statements": len(run.featurefile.statements),
+        "output_size": run.outputSize,
+    }
+    return stages, counts
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    addArguments(parser)
+    parser.add_argument(
+        "--scale",
+        type=int,
+        default=1,
+        help="Multiply the glyph, kern pair and rule counts by this factor",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument(
+        "--workdir", help="Generate the designspace here instead of a temporary dir"
+    )
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file")
+    args = parser.parse_args(args)
+
+    parameters = parametersFromArgs(args)
+    for key in ("glyphs", "kernPairs", "rules"):
+        parameters[key] *= args.scale
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir or tmpdir
+        start = time.perf_counter()
+        try:
+            path = makeDesignspace(workdir, **parameters)
+        except ValueError as e:
+            parser.error(str(e))
+        generation = time.perf_counter() - start
+        stages, counts = measure(path, repeat=args.repeat, jobs=args.jobs)
+
+    result = {
+        "parameters": dict(parameters, scale=args.scale, jobs=args.jobs),
+        "generation_time": generation,
+        "stages": stages,
+        "total_time": sum(stage["time"] for stage in stages.values()),
+        "counts": counts,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,64 +1,1062 @@
-from ufo2ft.featureCompiler import parseLayoutFeatures
-from ufo2ft.featureWriters import (
-    GdefFeatureWriter,
-    MarkFeatureWriter,
-    ast,
-    loadFeatureWriters,
-    isValidFeatureWriter,
-)
-from fontTools.designspaceLib import DesignSpaceDocument
+"""Generate variable OpenType layout features from a designspace.
+
+Heavy dependencies (fontTools, ufo2ft and the feature writers) are only
+imported when they're first needed, so that --help, and runs which
+process many designspaces in one interpreter, don't pay for them more
+than once.
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import stat
 import sys
 import importlib
-import ufoLib2
-from collections import OrderedDict
+import tempfile
+import time
 from types import SimpleNamespace
-from ufo2ft.util import makeOfficialGlyphOrder
-from fontTools.ttLib import TTFont
-from ufo2ft.constants import FEATURE_WRITERS_KEY
-
-from featureWriters.VariableKernWriter import VariableKernWriter
-from featureWriters.VariableMarkWriter import VariableMarkWriter
-from featureWriters.VariableRulesWriter import VariableRulesWriter
-
-defaultFeatureWriters = [VariableRulesWriter, VariableKernWriter, VariableMarkWriter]
-
-ds = DesignSpaceDocument.fromfile(sys.argv[1])
-ds.loadSourceFonts(opener=ufoLib2.Font.open)
-defaultufo = ds.findDefault().font
-featurefile = parseLayoutFeatures(defaultufo)
-
-glyphOrder = makeOfficialGlyphOrder(defaultufo)
-glyphSet = OrderedDict((gn, defaultufo[gn]) for gn in glyphOrder)
-ttFont = TTFont()
-ttFont.setGlyphOrder(glyphOrder)
-fakecompiler = SimpleNamespace(glyphSet=glyphSet, ttFont=ttFont, axes=ds.axes)
-
-writers = []
-
-for wdict in defaultufo.lib.get(FEATURE_WRITERS_KEY,[]):
-    moduleName = wdict.get("module", __name__)
-    className = wdict["class"]
-    if className == "KernFeatureWriter":
-        className = "VariableKernWriter"
-    elif className == "MarkFeatureWriter":
-        className = "VariableMarkWriter"
-    options = wdict.get("options", {})
-    if not isinstance(options, dict):
-        raise TypeError(type(options))
+
+log = logging.getLogger("ds2varlayout")
+
+defaultFeatureWriters = ["VariableRulesWriter", "VariableKernWriter", "VariableMarkWriter"]
+
+
+def findWriterClass(moduleName, className):
+    """Return the feature writer class named in the UFO lib. Writers without
+    a module are looked up in our featureWriters package first, then in
+    ufo2ft's."""
+    if moduleName is None:
+        if className in defaultFeatureWriters:
+            moduleName = "featureWriters." + className
+        else:
+            moduleName = "ufo2ft.featureWriters"
     module = importlib.import_module(moduleName)
-    klass = getattr(module, className)
-    if not isValidFeatureWriter(klass):
-        raise TypeError(klass)
-    writer = klass(**options)
-    writers.append(writer)
+    return getattr(module, className)
+
+
+def _stage(stats, name):
+    return stats.stage(name) if stats is not None else contextlib.nullcontext()
+
+
+def loadDesignspace(path, jobs=1, cache=None):
+    from fontTools.designspaceLib import DesignSpaceDocument
+    from featureWriters.LayoutFont import loadSourceFonts
+
+    ds = DesignSpaceDocument.fromfile(path)
+    loadSourceFonts(ds, jobs=jobs, cache=cache)
+    return ds
+
+
+def makeCompiler(ds, stats=None, tolerance=0, partial=None):
+    from fontTools.ttLib import TTFont
+    from ufo2ft.util import makeOfficialGlyphOrder
+    from featureWriters.LayoutFont import LazyGlyphSet
+    from featureWriters.MasterLocations import MasterLocations
+
+    defaultufo = ds.findDefault().font
+    glyphOrder = makeOfficialGlyphOrder(defaultufo)
+    glyphSetOrder = glyphOrder
+    if partial is not None:
+        glyphSetOrder = partial.glyphOrder(defaultufo, glyphOrder)
+    glyphSet = LazyGlyphSet(defaultufo, glyphSetOrder)
+    ttFont = TTFont()
+    ttFont.setGlyphOrder(glyphOrder)
+    return SimpleNamespace(
+        glyphSet=glyphSet,
+        ttFont=ttFont,
+        axes=ds.axes,
+        masterLocations=MasterLocations(ds, tolerance=tolerance),
+        stats=stats,
+    )
+
+
+def makeWriters(ds, partial=None):
+    from ufo2ft.constants import FEATURE_WRITERS_KEY
+    from ufo2ft.featureWriters import isValidFeatureWriter
+    from featureWriters.VariableRulesWriter import VariableRulesWriter
+
+    defaultufo = ds.findDefault().font
+    writers = []
+
+    for wdict in defaultufo.lib.get(FEATURE_WRITERS_KEY,[]):
+        moduleName = wdict.get("module")
+        className = wdict["class"]
+        if className == "KernFeatureWriter":
+            className = "VariableKernWriter"
+        elif className == "MarkFeatureWriter":
+            className = "VariableMarkWriter"
+        options = wdict.get("options", {})
+        if not isinstance(options, dict):
+            raise TypeError(type(options))
+        klass = findWriterClass(moduleName, className)
+        if not isValidFeatureWriter(klass):
+            raise TypeError(klass)
+        writer = klass(**options)
+        writers.append(writer)
+
+    if not writers:
+        writers = [findWriterClass(None, name)() for name in defaultFeatureWriters]
+
+    if ds.rules and not any(isinstance(writer, VariableRulesWriter) for writer in writers):
+        writers = [VariableRulesWriter()] + writers
+    if partial is not None:
+        writers = partial.filterWriters(writers)
+    return writers
+
+
+def writerFeatures(path):
+    """Return the feature tags the writers of the designspace at path can
+    write, reading only the designspace and its default source's lib."""
+    from fontTools.designspaceLib import DesignSpaceDocument
+    from featureWriters.LayoutFont import LayoutFont
+
+    ds = DesignSpaceDocument.fromfile(path)
+    default = ds.findDefault()
+    default.font = LayoutFont.open(default.path)
+    return frozenset().union(*(writer.features for writer in makeWriters(ds)))
+
+
+def generateFeatures(ds, compiler, writers, concurrency=None):
+    """Parse the default source's features and run the writers on them, the
+    same way for every entry point: each into its own fragment (see
+    writeFragments) if canWriteFragments allows it, otherwise one after
+    another on the parsed features themselves.
+
+    Returns the parsed features and the fragments. fragments is None if
+    the writers ran in sequence; without a concurrency it's a generator
+    running each writer as its fragment is requested."""
+    from ufo2ft.featureCompiler import parseLayoutFeatures
+
+    featurefile = parseLayoutFeatures(ds.findDefault().font)
+    if not canWriteFragments(featurefile, writers):
+        stats = getattr(compiler, "stats", None)
+        for writer in writers:
+            with _stage(stats, type(writer).__name__):
+                writer.write(ds, featurefile, compiler=compiler)
+        return featurefile, None
+    if concurrency is None:
+        fragments = (writeFragment(w, ds, featurefile, compiler) for w in writers)
+    else:
+        fragments = writeFragments(ds, featurefile, compiler, writers, concurrency)
+    return featurefile, fragments
+
+
+def writeFeatures(ds, compiler, writers, concurrency=None):
+    """Run the writers as generateFeatures does and return the whole feature
+    file."""
+    featurefile, fragments = generateFeatures(ds, compiler, writers, concurrency)
+    if fragments is not None:
+        featurefile = spliceFragments(featurefile, fragments)
+    return featurefile
+
+
+def canWriteFragments(featurefile, writers):
+    """Writers can only be run into separate fragments if none of them will
+    insert its output at an insert marker in the existing features."""
+    from ufo2ft.featureWriters import ast
+
+    for writer in writers:
+        marker = getattr(writer, "insertFeatureMarker", None)
+        if marker and next(ast.findCommentPattern(featurefile, marker), None):
+            return False
+    return True
+
+
+def writeFragment(writer, ds, featurefile, compiler):
+    """Run a writer against a private copy of the given feature file, and
+    return the list of statements it appended to it."""
+    from ufo2ft.featureWriters import ast
+
+    fragment = ast.FeatureFile()
+    fragment.statements = list(featurefile.statements)
+    with _stage(getattr(compiler, "stats", None), type(writer).__name__):
+        writer.write(ds, fragment, compiler=compiler)
+    return fragment.statements[len(featurefile.statements) :]
+
+
+# what _writeFragmentInChild works on, inherited by the forked processes
+_forkState = None
+
+
+def _writeFragmentInChild(index):
+    ds, featurefile, compiler, writers = _forkState
+    stats = compiler.stats
+    if stats is not None:
+        from featureWriters.BuildStats import BuildStats
+
+        stats = compiler.stats = BuildStats(profileDir=stats.profileDir)
+    compiler.masterLocations.popResults()
+    fragment = writeFragment(writers[index], ds, featurefile, compiler)
+    if stats is not None:
+        stats.dumpProfiles()
+        stats = (stats.stages, stats.counters)
+    return fragment, stats, compiler.masterLocations.popResults()
+
+
+def writeFragments(ds, featurefile, compiler, writers, concurrency=None):
+    """Run each writer into its own fragment, as writeFragment does, and
+    return the fragments in writer order.
+
+    With concurrency "threads" or "processes", the writers run at the same
+    time in a thread or forked process each; the fragments are the same as
+    when they run in sequence. Forked processes send their fragment, their
+    stats and the scalars they made back to this process.
+    """
+    if concurrency is None or len(writers) < 2:
+        return [writeFragment(w, ds, featurefile, compiler) for w in writers]
+    if concurrency == "processes":
+        import multiprocessing
+
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            log.warning("processes can't be forked here; running writers in threads")
+            concurrency = "threads"
+    if concurrency == "threads":
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=len(writers)) as pool:
+            futures = [
+                pool.submit(writeFragment, writer, ds, featurefile, compiler)
+                for writer in writers
+            ]
+            return [future.result() for future in futures]
+    if concurrency != "processes":
+        raise ValueError("unknown concurrency: %r" % concurrency)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    global _forkState
+    _forkState = (ds, featurefile, compiler, writers)
+    try:
+        with ProcessPoolExecutor(max_workers=len(writers), mp_context=context) as pool:
+            results = list(pool.map(_writeFragmentInChild, range(len(writers))))
+    finally:
+        _forkState = None
+    fragments = []
+    for fragment, stats, masterResults in results:
+        if stats is not None:
+            compiler.stats.merge(*stats)
+        compiler.masterLocations.addResults(masterResults)
+        fragments.append(fragment)
+    return fragments
+
+
+def spliceFragments(featurefile, fragments):
+    from ufo2ft.featureWriters import ast
+
+    result = ast.FeatureFile()
+    result.statements = list(featurefile.statements)
+    for fragment in fragments:
+        result.statements.extend(fragment)
+    return result
+
+
+def _contentHash(path, compress=False):
+    import hashlib
+
+    digest = hashlib.sha256()
+    if compress:
+        import gzip
+
+        f = gzip.open(path, "rb")
+    else:
+        f = open(path, "rb")
+    with f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def makeTempOutput(path):
+    """Create a temporary file next to path, to be moved over it with
+    replaceOutput, and return its file descriptor and path. It has the mode
+    of path if that exists, otherwise the mode the umask gives a new file,
+    rather than mkstemp's 0600."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmpPath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    os.chmod(tmpPath, mode)
+    return fd, tmpPath
+
+
+def replaceOutput(tmpPath, path, compress=False, onlyIfChanged=False):
+    """Move a complete temporary output file over path. With onlyIfChanged,
+    path is left untouched, keeping its modification time, if its content
+    is the same; gzip-compressed files are compared uncompressed. Returns
+    True if path was replaced."""
+    if onlyIfChanged and os.path.exists(path):
+        try:
+            same = _contentHash(tmpPath, compress) == _contentHash(path, compress)
+        except (OSError, EOFError):
+            same = False
+        if same:
+            os.remove(tmpPath)
+            log.info("%s is unchanged", path)
+            return False
+    os.replace(tmpPath, path)
+    return True
+
+
+@contextlib.contextmanager
+def openOutput(path, compress=False, onlyIfChanged=False):
+    """Open a text stream for the output: stdout if path is None or "-",
+    otherwise a temporary file which replaces path once it's complete, so
+    that a build watching the file never sees it half-written. The file is
+    gzip-compressed if compress is true or path ends in ".gz". With
+    onlyIfChanged, see replaceOutput."""
+    if path is None or path == "-":
+        yield sys.stdout
+        sys.stdout.flush()
+        return
+    compress = compress or path.endswith(".gz")
+    fd, tmpPath = makeTempOutput(path)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if compress:
+                import gzip
+
+                stream = gzip.open(f, "wt", encoding="utf-8")
+            else:
+                stream = io.TextIOWrapper(f, encoding="utf-8")
+            with stream:
+                yield stream
+    except BaseException:
+        os.remove(tmpPath)
+        raise
+    replaceOutput(tmpPath, path, compress=compress, onlyIfChanged=onlyIfChanged)
+
+
+def writeOutput(path, featurefile, compress=False, stats=None, onlyIfChanged=False):
+    from featureWriters.FeaStreamWriter import FeaStreamWriter
+
+    with openOutput(
+        path, compress=compress, onlyIfChanged=onlyIfChanged
+    ) as stream, _stage(stats, "serialize"):
+        writer = FeaStreamWriter(stream)
+        writer.writeAll(featurefile.statements)
+        writer.finish()
+
+
+def stream_features(
+    designspace,
+    output=None,
+    compress=False,
+    jobs=1,
+    cache=None,
+    stats=None,
+    tolerance=0,
+    concurrency=None,
+    partial=None,
+    onlyIfChanged=False,
+    depfile=None,
+    inputs=(),
+):
+    """Generate the variable layout features for a designspace and write them
+    to output (a path, or stdout if None) statement by statement.
+
+    Each writer's statements are serialized and released as soon as that
+    writer has run, so only one writer's output is held in memory at a
+    time, and the text of the whole feature file is never built. With a
+    concurrency (see writeFragments), the writers run at the same time, and
+    their output is serialized once they have all finished. A PartialBuild
+    limits the features, scripts or glyphs generated.
+
+    With onlyIfChanged, an existing output file is only replaced if the
+    features differ from its content. If a depfile is given, it lists the
+    other files read, such as a glyph list, given as inputs, then those read
+    from the designspace; see writeDependencies.
+    """
+    from featureWriters.FeaStreamWriter import FeaStreamWriter
+
+    designspace = _loadedDesignspace(designspace, jobs=jobs, cache=cache, stats=stats)
+    compiler = makeCompiler(
+        designspace, stats=stats, tolerance=tolerance, partial=partial
+    )
+    writers = makeWriters(designspace, partial=partial)
+    featurefile, fragments = generateFeatures(
+        designspace, compiler, writers, concurrency
+    )
+    if fragments is None:
+        writeOutput(
+            output,
+            featurefile,
+            compress=compress,
+            stats=stats,
+            onlyIfChanged=onlyIfChanged,
+        )
+        _finishStats(compiler)
+        writeDependencies(
+            depfile, output, designspace, featurefile, compiler, partial, inputs
+        )
+        return
+    with openOutput(output, compress=compress, onlyIfChanged=onlyIfChanged) as stream:
+        feaWriter = FeaStreamWriter(stream)
+        with _stage(stats, "serialize"):
+            feaWriter.writeAll(featurefile.statements)
+        for fragment in fragments:
+            with _stage(stats, "serialize"):
+                feaWriter.writeAll(fragment)
+        feaWriter.finish()
+    _finishStats(compiler)
+    writeDependencies(
+        depfile, output, designspace, featurefile, compiler, partial, inputs
+    )
+
+
+def writeDependencies(
+    depfile, target, designspace, featurefile, compiler, partial=None, inputs=()
+):
+    """Write a Make-style depfile saying that target depends on every file
+    read to generate it: first the given inputs, such as the --glyphs list
+    or the --merge-into font, then the designspace and the files of its
+    sources listed by layoutDependencies, which include every .glif file.
+    Glyphs left out of a partial build aren't listed, unless it filters
+    scripts, which reads the Unicode values of every glyph. Does nothing if
+    depfile is None."""
+    if depfile is None:
+        return
+    from featureWriters.DepFile import layoutDependencies, writeDepFile
+
+    glyphNames = None
+    if partial is not None and partial.scripts is None:
+        glyphNames = compiler.glyphSet.keys()
+    dependencies = layoutDependencies(
+        designspace, featurefile=featurefile, glyphNames=glyphNames
+    )
+    inputs = [os.path.abspath(path) for path in inputs]
+    writeDepFile(depfile, target, inputs + dependencies)
+
+
+def watch(
+    path, output, interval=1.0, jobs=1, tolerance=0, partial=None, compress=False
+):
+    """Regenerate the features of the designspace at path whenever one of its
+    sources changes, rerunning only the writers depending on the data that
+    changed. The sources are polled every interval seconds. The output is
+    written as by writeOutput.
+
+    If regenerating fails, e.g. on a file an editor has only half written,
+    the error is logged and the previous output kept; the next change
+    reloads everything."""
+    from featureWriters.SourceWatcher import SourceWatcher
+
+    def load():
+        ds = loadDesignspace(path, jobs=jobs)
+        compiler = makeCompiler(ds, tolerance=tolerance, partial=partial)
+        writers = makeWriters(ds, partial=partial)
+        featurefile, fragments = generateFeatures(ds, compiler, writers)
+        if fragments is not None:
+            fragments = list(fragments)
+        return ds, compiler, writers, featurefile, fragments
+
+    ds, compiler, writers, featurefile, fragments = load()
+    watcher = SourceWatcher(ds)
+    if fragments is None:
+        result = featurefile
+    else:
+        result = spliceFragments(featurefile, fragments)
+    writeOutput(output, result, compress=compress)
+    log.info("Wrote %s; watching for changes", output)
+
+    failed = False
+    while True:
+        time.sleep(interval)
+        try:
+            changes = watcher.poll()
+            if not changes:
+                continue
+            start = time.perf_counter()
+            if failed or "reload" in changes:
+                # after a failure, the fonts may be partly invalidated
+                ds, compiler, writers, featurefile, fragments = load()
+                watcher = SourceWatcher(ds)
+                rerun = writers
+            elif fragments is None:
+                # the writers build on each other's output, so all rerun
+                compiler.__dict__.pop("_gsub", None)
+                featurefile, _ = generateFeatures(ds, compiler, writers)
+                rerun = writers
+            else:
+                # the temporary GSUB is cached on the compiler
+                compiler.__dict__.pop("_gsub", None)
+                rerun = [
+                    writer
+                    for writer in writers
+                    if getattr(writer, "dependsOn", None) is None
+                    or writer.dependsOn & changes
+                ]
+                for i, writer in enumerate(writers):
+                    if writer in rerun:
+                        fragments[i] = writeFragment(writer, ds, featurefile, compiler)
+            if fragments is None:
+                result = featurefile
+            else:
+                result = spliceFragments(featurefile, fragments)
+            writeOutput(output, result, compress=compress)
+        except Exception:
+            log.exception(
+                "regenerating %s failed; keeping the previous output until "
+                "the next change",
+                output,
+            )
+            failed = True
+            continue
+        failed = False
+        log.info(
+            "%s changed; reran %s in %.1f ms",
+            ", ".join(sorted(changes)),
+            ", ".join(type(writer).__name__ for writer in rerun),
+            (time.perf_counter() - start) * 1000,
+        )
+
+
+def _loadedDesignspace(designspace, jobs=1, cache=None, stats=None):
+    from featureWriters.LayoutFont import loadSourceFonts
+
+    with _stage(stats, "load"):
+        if isinstance(designspace, str):
+            designspace = loadDesignspace(designspace, jobs=jobs, cache=cache)
+        else:
+            loadSourceFonts(designspace, jobs=jobs, cache=cache)
+        if stats is not None:
+            # sources are read lazily; read everything the writers will now,
+            # so that the time is accounted to loading rather than to the
+            # first writer touching it
+            for source in designspace.sources:
+                font = source.font
+                font.kerning, font.groups
+                for glyphName in font.keys():
+                    font[glyphName]
+    return designspace
+
+
+def _finishStats(compiler):
+    masterLocations = compiler.masterLocations
+    pruned = masterLocations.pruned
+    if masterLocations.tolerance:
+        saved = pruned["deltasBefore"] - pruned["deltasAfter"]
+        log.info(
+            "pruning dropped %d master values (%d scalars now constant), "
+            "saving %d of %d deltas before VarStore deduplication",
+            pruned["mastersDropped"],
+            pruned["scalarsCollapsed"],
+            saved,
+            pruned["deltasBefore"],
+        )
+    stats = compiler.stats
+    if stats is not None:
+        stats.count("masterLocationSets", len(masterLocations.locationSets))
+        stats.count("scalars", len(masterLocations.scalars))
+        stats.count("quantizedScalars", len(masterLocations.quantizedScalars))
+        stats.count("scalarRequests", masterLocations.scalarRequests)
+        for name, value in pruned.items():
+            stats.count("prune." + name, value)
+
+
+def build_features(
+    designspace,
+    jobs=1,
+    cache=None,
+    compiler=None,
+    stats=None,
+    tolerance=0,
+    concurrency=None,
+    partial=None,
+):
+    """Generate the variable layout features for a designspace, given as a
+    path or a DesignSpaceDocument, and return them as a feaLib FeatureFile.
+    If a compiler is given, the designspace sources must already be loaded.
+    The writers run as generateFeatures does, as for stream_features; with
+    a concurrency, they run at the same time. A PartialBuild limits the
+    features, scripts or glyphs generated."""
+    if compiler is None:
+        designspace = _loadedDesignspace(
+            designspace, jobs=jobs, cache=cache, stats=stats
+        )
+        compiler = makeCompiler(
+            designspace, stats=stats, tolerance=tolerance, partial=partial
+        )
+    writers = makeWriters(designspace, partial=partial)
+    featurefile = writeFeatures(designspace, compiler, writers, concurrency)
+    _finishStats(compiler)
+    return featurefile
+
+
+def addFvar(ttFont, ds):
+    """Add an fvar table describing the designspace axes, which feaLib needs
+    to compile variable scalars and condition sets."""
+    from fontTools.ttLib import newTable
+    from fontTools.ttLib.tables._f_v_a_r import Axis
+
+    if "name" not in ttFont:
+        ttFont["name"] = newTable("name")
+        ttFont["name"].names = []
+    fvar = ttFont["fvar"] = newTable("fvar")
+    fvar.axes = []
+    fvar.instances = []
+    for dsAxis in ds.axes:
+        axis = Axis()
+        axis.axisTag = dsAxis.tag
+        axis.minValue = dsAxis.minimum
+        axis.defaultValue = dsAxis.default
+        axis.maxValue = dsAxis.maximum
+        labelNames = dict(dsAxis.labelNames) or {"en": dsAxis.name}
+        axis.axisNameID = ttFont["name"].addMultilingualName(
+            labelNames, ttFont, minNameID=256
+        )
+        axis.flags = int(getattr(dsAxis, "hidden", False))
+        fvar.axes.append(axis)
+
+
+def addGlyphOrderTables(ttFont):
+    """Add the minimal maxp and post tables that let a layout-only font be
+    read back with its glyph names."""
+    from fontTools.ttLib import newTable
+
+    glyphOrder = ttFont.getGlyphOrder()
+    maxp = ttFont["maxp"] = newTable("maxp")
+    maxp.tableVersion = 0x00005000
+    maxp.numGlyphs = len(glyphOrder)
+    post = ttFont["post"] = newTable("post")
+    post.formatType = 2.0
+    post.italicAngle = 0
+    post.underlinePosition = 0
+    post.underlineThickness = 0
+    post.isFixedPitch = 0
+    post.minMemType42 = post.maxMemType42 = 0
+    post.minMemType1 = post.maxMemType1 = 0
+    post.extraNames = []
+    post.mapping = {}
+    post.glyphOrder = glyphOrder
+
+
+def _normalizeGlyphClasses(node, seen=None):
+    # ufo2ft builds glyph classes out of GlyphName objects, while feaLib's
+    # builder expects the plain glyph name strings its parser produces
+    from fontTools.feaLib import ast
+
+    if seen is None:
+        seen = set()
+    if id(node) in seen:
+        return
+    seen.add(id(node))
+    if isinstance(node, (list, tuple)):
+        for item in node:
+            _normalizeGlyphClasses(item, seen)
+    elif isinstance(node, dict):
+        for item in node.values():
+            _normalizeGlyphClasses(item, seen)
+    elif isinstance(node, (ast.Element, ast.Expression)):
+        if isinstance(node, ast.GlyphClass):
+            node.glyphs = [
+                g.glyph if isinstance(g, ast.GlyphName) else g for g in node.glyphs
+            ]
+        for value in vars(node).values():
+            _normalizeGlyphClasses(value, seen)
+
+
+def compile_features(
+    designspace,
+    output,
+    mergeInto=None,
+    jobs=1,
+    cache=None,
+    stats=None,
+    tolerance=0,
+    concurrency=None,
+    partial=None,
+    onlyIfChanged=False,
+    depfile=None,
+    inputs=(),
+):
+    """Compile the variable layout features of a designspace straight from the
+    feature file AST into binary GSUB, GPOS and GDEF tables, without going
+    through .fea text.
+
+    If mergeInto is the path of an existing variable font, the tables are
+    added to (or replace those of) that font; otherwise a font containing
+    only the layout tables, the fvar table and the glyph names is written.
+    With onlyIfChanged, an existing output font is only replaced if the
+    saved font differs from it; the head table's modification time is then
+    kept from mergeInto rather than set to the current time. A depfile is
+    written as by stream_features, with mergeInto among the inputs. Returns
+    the compiled TTFont.
+    """
+    from fontTools.feaLib.builder import Builder
+    from fontTools.ttLib import TTFont
+
+    designspace = _loadedDesignspace(designspace, jobs=jobs, cache=cache, stats=stats)
+    compiler = makeCompiler(
+        designspace, stats=stats, tolerance=tolerance, partial=partial
+    )
+    featurefile = build_features(
+        designspace, compiler=compiler, concurrency=concurrency, partial=partial
+    )
+    if mergeInto is not None:
+        ttFont = TTFont(mergeInto)
+        if "fvar" not in ttFont:
+            addFvar(ttFont, designspace)
+    else:
+        ttFont = compiler.ttFont
+        addGlyphOrderTables(ttFont)
+        addFvar(ttFont, designspace)
+    with _stage(stats, "compile"):
+        _normalizeGlyphClasses(featurefile)
+        Builder(ttFont, featurefile).build(tables={"GSUB", "GPOS", "GDEF"})
+        if onlyIfChanged:
+            ttFont.recalcTimestamp = False
+            fd, tmpPath = makeTempOutput(output)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    ttFont.save(f)
+            except BaseException:
+                os.remove(tmpPath)
+                raise
+            replaceOutput(tmpPath, output, onlyIfChanged=True)
+        else:
+            ttFont.save(output)
+    writeDependencies(
+        depfile,
+        output,
+        designspace,
+        featurefile,
+        compiler,
+        partial,
+        inputs=list(inputs) + ([mergeInto] if mergeInto is not None else []),
+    )
+    varStore = getattr(ttFont.get("GDEF"), "table", None)
+    varStore = getattr(varStore, "VarStore", None)
+    if varStore is not None and tolerance:
+        log.info(
+            "VarStore: %d regions, %d rows, %d deltas",
+            len(varStore.VarRegionList.Region),
+            sum(data.ItemCount for data in varStore.VarData),
+            sum(data.ItemCount * data.VarRegionCount for data in varStore.VarData),
+        )
+    if stats is not None:
+        for tag in ("GSUB", "GPOS", "GDEF"):
+            if tag in ttFont:
+                stats.count("compile.%sSize" % tag, len(ttFont.getTableData(tag)))
+    return ttFont
+
+
+def readManifest(path):
+    """Read a batch manifest: one designspace path per line, optionally
+    followed by the path of its output file, both relative to the manifest.
+    Blank lines and lines starting with '#' are ignored."""
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split(None, 1)
+            designspace = os.path.join(base, fields[0])
+            output = os.path.join(base, fields[1]) if len(fields) > 1 else None
+            jobs.append((designspace, output))
+    return jobs
+
+
+def defaultOutputPath(designspace, outputDir=None, compress=False):
+    stem = os.path.splitext(os.path.basename(designspace))[0]
+    directory = outputDir or os.path.dirname(os.path.abspath(designspace))
+    return os.path.join(directory, stem + (".fea.gz" if compress else ".fea"))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Generate variable layout features")
+    parser.add_argument("designspace", nargs="*", help="Designspace file(s) to read")
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        help="Read the designspaces to process, and optionally their output "
+        "paths, from this file, one per line",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Write the features to this file instead of stdout (only with "
+        "a single designspace)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        help="In batch mode, write each designspace's features to NAME.fea "
+        "in this directory instead of next to the designspace",
+    )
+    parser.add_argument(
+        "-z",
+        "--gzip",
+        action="store_true",
+        help="Gzip-compress the .fea output (implied by an output path ending "
+        "in .gz)",
+    )
+    parser.add_argument(
+        "-b",
+        "--binary",
+        metavar="FONT",
+        help="Compile the features to binary GSUB/GPOS/GDEF tables and save "
+        "them in this font file instead of writing .fea text",
+    )
+    parser.add_argument(
+        "--merge-into",
+        metavar="FONT",
+        help="With --binary, add the compiled tables to this existing "
+        "variable font instead of a layout-only font",
+    )
+    parser.add_argument(
+        "--only-if-changed",
+        action="store_true",
+        help="Leave an existing output file untouched, keeping its "
+        "modification time, if the generated content is the same",
+    )
+    parser.add_argument(
+        "--depfile",
+        metavar="FILE",
+        help="Write a Make/Ninja depfile listing every file read to generate "
+        "the output (only with a single designspace): the designspace, the "
+        "--glyphs and --merge-into files, and the source files, including "
+        "every .glif file. Outline-only edits therefore rerun the tool too; "
+        "add --only-if-changed to keep them from reaching later build steps",
+    )
+    parser.add_argument(
+        "--features",
+        metavar="TAGS",
+        help="Only generate these comma-separated features (kern, dist, mark, "
+        "mkmk, abvm, blwm, rvrn)",
+    )
+    parser.add_argument(
+        "--scripts",
+        metavar="TAGS",
+        help="Only generate features for the glyphs of these comma-separated "
+        "OpenType script tags, plus common, inherited and unencoded glyphs",
+    )
+    parser.add_argument(
+        "--glyphs",
+        metavar="FILE",
+        help="Only generate features for the glyphs listed in this file",
+    )
+    parser.add_argument(
+        "--concurrent-writers",
+        choices=["threads", "processes"],
+        help="Run the feature writers at the same time, in threads or in "
+        "forked processes; the output is the same",
+    )
+    parser.add_argument(
+        "--prune-tolerance",
+        type=float,
+        default=0,
+        metavar="UNITS",
+        help="Drop the kerning and anchor values of masters which the other "
+        "masters interpolate to within this many units",
+    )
+    parser.add_argument(
+        "--stats",
+        metavar="FILE",
+        help="Write timings, memory growth and counters for each stage as JSON "
+        "to this file ('-' for stderr)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile each stage with cProfile and write the .prof files in "
+        "this directory",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Load and extract sources in this many worker processes",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Cache the data extracted from each source in this directory",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help="Keep running and regenerate the output whenever a source changes",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="With --watch, check the sources for changes this often; each "
+        "check reads the file times of every glyph of every source",
+    )
+    args = parser.parse_args(args)
+
+    batch = [(designspace, None) for designspace in args.designspace]
+    if args.manifest:
+        batch.extend(readManifest(args.manifest))
+    if not batch:
+        parser.error("no designspace given")
+    if len(batch) > 1 and (args.output or args.binary):
+        parser.error(
+            "--output and --binary can only be used with a single designspace"
+        )
+    if args.output and args.binary:
+        parser.error("--output and --binary are mutually exclusive")
+    if args.merge_into and not args.binary:
+        parser.error("--merge-into requires --binary")
+    if args.depfile and len(batch) > 1:
+        parser.error("--depfile can only be used with a single designspace")
+    partial = None
+    if args.features or args.scripts or args.glyphs:
+        from featureWriters.PartialBuild import PartialBuild, readGlyphList
+
+        partial = PartialBuild(
+            features=args.features.split(",") if args.features else None,
+            scripts=args.scripts.split(",") if args.scripts else None,
+            glyphs=readGlyphList(args.glyphs) if args.glyphs else None,
+        )
+    if partial is not None and partial.features is not None:
+        known = frozenset().union(
+            *(writerFeatures(designspace) for designspace, _ in batch)
+        )
+        unknown = partial.features - known
+        if unknown:
+            parser.error(
+                "no feature writer writes %s; the writers write %s"
+                % (", ".join(sorted(unknown)), ", ".join(sorted(known)))
+            )
+    outputs = []
+    for designspace, output in batch:
+        if output is None:
+            if len(batch) == 1 and not args.output_dir:
+                output = args.output
+            else:
+                output = defaultOutputPath(
+                    designspace, args.output_dir, compress=args.gzip
+                )
+        outputs.append((designspace, output))
+    written = {}
+    for designspace, output in outputs:
+        if output in (None, "-"):
+            continue
+        key = os.path.normcase(os.path.abspath(output))
+        if key in written:
+            parser.error(
+                "%s and %s would both be written to %s"
+                % (written[key], designspace, output)
+            )
+        written[key] = designspace
+    if not args.binary and outputs[0][1] in (None, "-"):
+        if args.depfile:
+            parser.error("--depfile requires an output file")
+        if args.gzip:
+            parser.error("--gzip requires an output file")
+    if args.gzip and args.binary:
+        parser.error("--gzip only applies to .fea output, not --binary")
+    if args.prune_tolerance:
+        # show the pruning report
+        logging.basicConfig(format="%(message)s")
+        log.setLevel(logging.INFO)
+
+    if args.watch:
+        if len(batch) != 1:
+            parser.error("--watch can only be used with a single designspace")
+        output = args.output or batch[0][1]
+        if not output:
+            parser.error("--watch requires --output")
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        try:
+            watch(
+                batch[0][0],
+                output,
+                interval=args.watch_interval,
+                jobs=args.jobs,
+                tolerance=args.prune_tolerance,
+                partial=partial,
+                compress=args.gzip,
+            )
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    cache = None
+    if args.cache_dir:
+        from featureWriters.ExtractionCache import ExtractionCache
+
+        cache = ExtractionCache(args.cache_dir)
+
+    reports = {}
+
+    def makeStats(designspace):
+        if not (args.stats or args.profile):
+            return None
+        from featureWriters.BuildStats import BuildStats
+
+        profileDir = args.profile
+        if profileDir and len(batch) > 1:
+            stem = os.path.splitext(os.path.basename(designspace))[0]
+            profileDir = os.path.join(profileDir, stem)
+        stats = reports[designspace] = BuildStats(profileDir=profileDir)
+        return stats
+
+    # read besides the designspaces, for the depfile
+    inputs = [args.glyphs] if args.glyphs else []
+
+    if args.binary:
+        compile_features(
+            batch[0][0],
+            args.binary,
+            mergeInto=args.merge_into,
+            jobs=args.jobs,
+            cache=cache,
+            stats=makeStats(batch[0][0]),
+            tolerance=args.prune_tolerance,
+            concurrency=args.concurrent_writers,
+            partial=partial,
+            onlyIfChanged=args.only_if_changed,
+            depfile=args.depfile,
+            inputs=inputs,
+        )
+    else:
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        for designspace, output in outputs:
+            stream_features(
+                designspace,
+                output,
+                compress=args.gzip,
+                jobs=args.jobs,
+                cache=cache,
+                stats=makeStats(designspace),
+                tolerance=args.prune_tolerance,
+                concurrency=args.concurrent_writers,
+                partial=partial,
+                onlyIfChanged=args.only_if_changed,
+                depfile=args.depfile,
+                inputs=inputs,
+            )
 
-if not writers:
-    writers = [writer() for writer in defaultFeatureWriters]
+    for stats in reports.values():
+        stats.dumpProfiles()
+    if args.stats:
+        import json
 
-if ds.rules and not any(isinstance(writer, VariableRulesWriter) for writer in writers):
-    writers = [VariableRulesWriter()] + writers
+        text = json.dumps(
+            {designspace: stats.report() for designspace, stats in reports.items()},
+            indent=2,
+        )
+        if args.stats == "-":
+            sys.stderr.write(text + "\n")
+        else:
+            with open(args.stats, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+    return 0
 
-for writer in writers:
-    writer.write(ds, featurefile, compiler=fakecompiler)
 
-print(featurefile)
+if __name__ == "__main__":
+    sys.exit(main())
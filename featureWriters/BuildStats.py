@@ -0,0 +1,137 @@
+from collections import Counter, OrderedDict
+import contextlib
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+def _maxRSS():
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if os.uname().sysname == "Darwin" else maxrss * 1024
+
+
+def _currentRSS():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _difference(after, before):
+    if after is None or before is None:
+        return None
+    return after - before
+
+
+def _add(total, value):
+    if total is None or value is None:
+        return None
+    return total + value
+
+
+def _newStage():
+    return {"time": 0.0, "calls": 0, "peak_rss_growth": 0, "rss_change": 0}
+
+
+class BuildStats:
+    """Timings, memory use and counters collected while generating features.
+
+    The build wraps each step (source loading, every writer's write(),
+    serialization) in stage(), which records its wall time and memory, and
+    optionally profiles it with cProfile. Writers find the instance on the
+    compiler object and add to its counters with count().
+
+    The memory of a stage is given as two byte counts: peak_rss_growth, how
+    much the process' peak resident memory grew during the stage (zero if
+    it stayed below an earlier stage's peak), and rss_change, the
+    difference in resident memory from its start to its end (Linux only;
+    None elsewhere). Stages running at the same time in threads share the
+    process, so their memory can't be told apart.
+    """
+
+    def __init__(self, profileDir=None):
+        self.stages = OrderedDict()
+        self.counters = Counter()
+        self.profileDir = profileDir
+        self._profiles = {}
+        # writers may run in threads at the same time
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measure a step of the build. Stages entered several times under
+        the same name accumulate their time."""
+        profile = None
+        if self.profileDir is not None:
+            import cProfile
+
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        maxRSS = _maxRSS()
+        rss = _currentRSS()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                stage = self.stages.setdefault(name, _newStage())
+                stage["time"] += elapsed
+                stage["calls"] += 1
+                stage["peak_rss_growth"] = _add(
+                    stage["peak_rss_growth"], _difference(_maxRSS(), maxRSS)
+                )
+                stage["rss_change"] = _add(
+                    stage["rss_change"], _difference(_currentRSS(), rss)
+                )
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += int(value)
+
+    def merge(self, stages, counters):
+        """Add the stages and counters recorded by a BuildStats in another
+        process."""
+        with self._lock:
+            for name, other in stages.items():
+                stage = self.stages.setdefault(name, _newStage())
+                for key, value in other.items():
+                    stage[key] = _add(stage[key], value)
+            self.counters.update(counters)
+
+    def dumpProfiles(self):
+        """Write one .prof file per profiled stage into profileDir, and return
+        their paths."""
+        paths = []
+        if self.profileDir is None:
+            return paths
+        os.makedirs(self.profileDir, exist_ok=True)
+        for name, profile in self._profiles.items():
+            path = os.path.join(self.profileDir, name + ".prof")
+            profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def report(self):
+        return {
+            "stages": dict(self.stages),
+            "total_time": sum(stage["time"] for stage in self.stages.values()),
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+
+def getStats(compiler):
+    """Return the BuildStats attached to the compiler, or None."""
+    return getattr(compiler, "stats", None)
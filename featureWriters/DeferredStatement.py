@@ -0,0 +1,26 @@
+class DeferredStatement:
+    """Stands in a lookup block for a feaLib AST statement which is only
+    made when the feature file is written out or compiled, and dropped
+    right after, so the AST of all the pos rules is never held at once.
+
+    makeAST is called with args to make the statement each time it's
+    needed; it must be a function or bound method which can be pickled.
+    """
+
+    __slots__ = ("makeAST", "args")
+
+    def __init__(self, makeAST, *args):
+        self.makeAST = makeAST
+        self.args = args
+
+    def asAST(self):
+        return self.makeAST(*self.args)
+
+    def asFea(self, indent=""):
+        return self.asAST().asFea(indent=indent)
+
+    def build(self, builder):
+        self.asAST().build(builder)
+
+    def __str__(self):
+        return self.asFea()
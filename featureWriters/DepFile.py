@@ -0,0 +1,98 @@
+from .LayoutFont import (
+    DEFAULT_SOURCE_FILES,
+    GLYPH_SET_FILES,
+    LayoutFont,
+    sourceLayer,
+)
+import os
+
+# Files at the top level of every source UFO which are read; layer sources
+# only read the first two. See DEFAULT_SOURCE_FILES for the default source.
+SOURCE_FILES = (
+    "metainfo.plist",
+    "layercontents.plist",
+    "kerning.plist",
+    "groups.plist",
+)
+
+
+def _includedFiles(statements, result):
+    # included feature files are inlined by the parser; the statements they
+    # contributed still carry their file name
+    for statement in statements:
+        location = getattr(statement, "location", None)
+        if location is not None and location.file:
+            result.append(os.path.abspath(location.file))
+        _includedFiles(getattr(statement, "statements", ()), result)
+
+
+def _walkFiles(path):
+    files = []
+    for directory, _, fileNames in os.walk(path):
+        files.extend(os.path.join(directory, name) for name in sorted(fileNames))
+    return files
+
+
+def layoutDependencies(designspace, featurefile=None, glyphNames=None):
+    """Return the paths of the files feature generation reads for a loaded
+    designspace, in a stable order without duplicates.
+
+    These are the designspace itself and, for each source UFO, the files
+    listed in SOURCE_FILES which exist (only metainfo.plist and
+    layercontents.plist for layer sources), plus DEFAULT_SOURCE_FILES for
+    the default source; the GLYPH_SET_FILES of each glyphs directory read;
+    and the .glif file of every glyph, since the writers parse all of them
+    for anchors and Unicode values. An outline-only edit therefore still
+    makes the output out of date; use --only-if-changed so that it doesn't
+    propagate further. If featurefile is the AST parsed from the default
+    source's features, the files it includes are added. glyphNames limits
+    the glyphs to those of a partial build.
+
+    Sources which aren't LayoutFonts are read in full, so every file of
+    their UFO is listed.
+    """
+    paths = [os.path.abspath(designspace.path)]
+    default = designspace.findDefault()
+    for source in designspace.sources:
+        font = source.font
+        if not isinstance(font, LayoutFont):
+            paths.extend(_walkFiles(source.path))
+            continue
+        if source.layerName is not None:
+            # the kerning and groups of a layer source's UFO aren't read
+            names = SOURCE_FILES[:2]
+        elif source is default:
+            names = SOURCE_FILES + tuple(sorted(DEFAULT_SOURCE_FILES))
+        else:
+            names = SOURCE_FILES
+        for name in names:
+            path = os.path.join(font.path, name)
+            if os.path.exists(path):
+                paths.append(os.path.abspath(path))
+        layer = sourceLayer(source)
+        glyphsPath = layer.glyphsPath
+        if glyphsPath is None:
+            paths.append(os.path.abspath(font.path))
+            continue
+        for name in sorted(GLYPH_SET_FILES):
+            paths.append(os.path.join(glyphsPath, name))
+        for glyphName in layer.keys() if glyphNames is None else glyphNames:
+            if glyphName in layer:
+                paths.append(layer.glyphPath(glyphName))
+    if featurefile is not None:
+        _includedFiles(featurefile.statements, paths)
+    return list(dict.fromkeys(paths))
+
+
+def _escape(path):
+    # Make syntax; ninja reads the same escapes
+    return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+
+def writeDepFile(path, target, dependencies):
+    """Write a Make-style depfile saying that target depends on the given
+    paths."""
+    lines = [_escape(target) + ":"]
+    lines.extend(" " + _escape(dependency) for dependency in dependencies)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(" \\\n".join(lines) + "\n")
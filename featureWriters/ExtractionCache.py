@@ -0,0 +1,130 @@
+from .LayoutFont import LayoutFont, extractGlyphData, extractLayoutData
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+log = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+class ExtractionCache:
+    """On-disk cache of the data extracted from each UFO source.
+
+    Each source gets one pickle file in the cache directory, holding its
+    kerning, groups and per-glyph Unicode values and anchors, together with
+    the (modified time, size) signature of the file each piece was read
+    from. On the next run only the files whose signature changed are read
+    again. Entries are evicted least-recently-used first once the directory
+    grows past maxSize bytes.
+    """
+
+    def __init__(self, directory, maxSize=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.maxSize = maxSize
+        os.makedirs(directory, exist_ok=True)
+
+    def _entryPath(self, path, layerName=None):
+        key = "%s\0%s" % (os.path.abspath(path), layerName or "")
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".pickle")
+
+    def _readEntry(self, entryPath):
+        try:
+            with open(entryPath, "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning("ignoring unreadable cache entry %s: %s", entryPath, e)
+            return None
+        if entry.get("version") != CACHE_VERSION:
+            return None
+        return entry
+
+    def _writeEntry(self, entryPath, entry):
+        fd, tmpPath = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, entryPath)
+
+    def extract(self, path, layerName=None):
+        """Return the same data as extractLayoutData, reusing the cached
+        kerning, groups and glyphs whose files haven't changed."""
+        font = LayoutFont.open(path, layerName=layerName)
+        if not isinstance(font, LayoutFont):
+            # UFO 2 sources are converted on load and not cached
+            return extractLayoutData(path, layerName)
+
+        entryPath = self._entryPath(path, layerName)
+        entry = self._readEntry(entryPath) or {"version": CACHE_VERSION}
+        changed = False
+
+        def cached(name, signature, read):
+            nonlocal changed
+            old = entry.get(name)
+            if old is not None and old[0] == signature:
+                return old[1]
+            changed = True
+            value = read()
+            entry[name] = (signature, value)
+            return value
+
+        kerning = cached(
+            "kerning", font.fileSignature("kerning.plist"), lambda: dict(font.kerning)
+        )
+        groups = cached(
+            "groups",
+            font.fileSignature("groups.plist"),
+            lambda: {k: list(v) for k, v in font.groups.items()},
+        )
+
+        oldGlyphs = entry.get("glyphs", {})
+        glyphs = {}
+        newGlyphs = {}
+        for glyphName in font.keys():
+            signature = font.glyphSignature(glyphName)
+            old = oldGlyphs.get(glyphName)
+            if old is not None and old[0] == signature:
+                data = old[1]
+            else:
+                data = extractGlyphData(font[glyphName])
+                changed = True
+            glyphs[glyphName] = data
+            newGlyphs[glyphName] = (signature, data)
+        if len(newGlyphs) != len(oldGlyphs):
+            changed = True
+        entry["glyphs"] = newGlyphs
+
+        if changed:
+            self._writeEntry(entryPath, entry)
+            self.evict()
+        else:
+            os.utime(entryPath)
+        return kerning, groups, glyphs
+
+    def evict(self):
+        """Remove the least recently used entries until the cache directory
+        fits in maxSize bytes."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".pickle"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        for _, size, entryPath in sorted(entries):
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(entryPath)
+            except FileNotFoundError:
+                pass
+            total -= size
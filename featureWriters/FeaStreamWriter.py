@@ -0,0 +1,69 @@
+from fontTools.feaLib import ast
+from fontTools.feaLib.ast import SHIFT
+
+
+def _extension(block):
+    return "useExtension " if block.use_extension else ""
+
+
+def _writeBlockBody(block, stream, indent):
+    # same output as ast.Block.asFea, one statement at a time
+    indent += SHIFT
+    stream.write(indent)
+    for i, statement in enumerate(block.statements):
+        if i:
+            stream.write("\n" + indent)
+        writeStatement(statement, stream, indent)
+    stream.write("\n")
+
+
+def writeStatement(statement, stream, indent=""):
+    """Write the feature file syntax of a statement to a text stream. This
+    produces the same text as statement.asFea(indent), but feature, lookup
+    and variation blocks are written statement by statement, so no string
+    for the whole block is ever built."""
+    asFea = type(statement).asFea
+    if asFea is ast.FeatureBlock.asFea:
+        name = statement.name.strip()
+        stream.write(indent + "feature %s %s{\n" % (name, _extension(statement)))
+        _writeBlockBody(statement, stream, indent)
+        stream.write(indent + "} %s;\n" % name)
+    elif asFea is ast.LookupBlock.asFea:
+        name = statement.name
+        stream.write("lookup %s %s{\n" % (name, _extension(statement)))
+        _writeBlockBody(statement, stream, indent)
+        stream.write(indent + "} %s;\n" % name)
+    elif asFea is ast.VariationBlock.asFea:
+        name = statement.name.strip()
+        stream.write(
+            indent
+            + "variation %s %s %s{\n"
+            % (name, statement.conditionset, _extension(statement))
+        )
+        _writeBlockBody(statement, stream, indent)
+        stream.write(indent + "} %s;\n" % name)
+    else:
+        stream.write(statement.asFea(indent=indent))
+
+
+class FeaStreamWriter:
+    """Write the top-level statements of a feature file to a text stream as
+    they are produced. The complete output is the same as printing the
+    FeatureFile holding all the statements."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._empty = True
+
+    def write(self, statement):
+        if not self._empty:
+            self.stream.write("\n")
+        self._empty = False
+        writeStatement(statement, self.stream)
+
+    def writeAll(self, statements):
+        for statement in statements:
+            self.write(statement)
+
+    def finish(self):
+        self.stream.write("\n")
@@ -0,0 +1,357 @@
+from fontTools.ufoLib import UFOReader
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree.ElementTree import XMLPullParser
+from types import SimpleNamespace
+import fs.errors
+import os
+
+# Files at the top level of the default source which affect every writer
+DEFAULT_SOURCE_FILES = frozenset(["features.fea", "lib.plist", "fontinfo.plist"])
+# Files in a glyphs directory which change the glyph set itself
+GLYPH_SET_FILES = frozenset(["contents.plist"])
+
+
+class LayoutAnchor:
+    __slots__ = ("name", "x", "y")
+
+    def __init__(self, name, x, y):
+        self.name = name
+        self.x = x
+        self.y = y
+
+
+class LayoutGlyph:
+    """A glyph reduced to the data the layout feature writers look at: its
+    name, Unicode values and anchors."""
+
+    __slots__ = ("name", "unicodes", "anchors")
+
+    def __init__(self, name, unicodes=None, anchors=None):
+        self.name = name
+        self.unicodes = unicodes or []
+        self.anchors = anchors or []
+
+    @property
+    def unicode(self):
+        return self.unicodes[0] if self.unicodes else None
+
+
+def toNumber(value):
+    """Return value as an int if it's integral, otherwise as a float."""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def parseLayoutGlyph(glyphName, data):
+    """Parse the <unicode> and <anchor> elements of a GLIF file, skipping
+    over outlines, components and the glyph lib."""
+    unicodes = []
+    anchors = []
+    parser = XMLPullParser(events=("end",))
+    parser.feed(data)
+    for _, element in parser.read_events():
+        tag = element.tag
+        if tag == "unicode":
+            unicodes.append(int(element.attrib["hex"], 16))
+        elif tag == "anchor":
+            attrib = element.attrib
+            anchors.append(
+                LayoutAnchor(
+                    attrib.get("name"),
+                    toNumber(attrib.get("x", 0)),
+                    toNumber(attrib.get("y", 0)),
+                )
+            )
+        # drop outline points and lib contents as soon as they're parsed
+        element.clear()
+    parser.close()
+    return LayoutGlyph(glyphName, unicodes, anchors)
+
+
+def _fileSignature(fileSystem, fileName):
+    try:
+        info = fileSystem.getinfo(fileName, namespaces=["details"])
+    except fs.errors.ResourceNotFound:
+        return None
+    return (info.raw["details"].get("modified"), info.size)
+
+
+class LayoutFont:
+    """A read-only UFO which only loads the pieces needed to generate layout
+    features: kerning, groups, features, lib, fontinfo and the Unicode values
+    and anchors of each glyph. Each piece is read lazily on first access, and
+    glyphs are parsed one at a time as they are requested.
+
+    Only UFO 3 sources are supported; use LayoutFont.open, which falls back
+    to a full ufoLib2 Font for older formats.
+
+    With a layerName, the glyphs are read from that layer, as for a sparse
+    designspace source; kerning and groups belong to the whole font, so a
+    layer has none.
+    """
+
+    def __init__(self, path, layerName=None):
+        self.path = path
+        self.layerName = layerName
+        self._reader = UFOReader(path, validate=False)
+        self._glyphSet = self._reader.getGlyphSet(layerName, validateRead=False)
+        self._glyphs = {}
+        self._layers = {}
+        if layerName is None:
+            self._kerning = None
+            self._groups = None
+        else:
+            self._kerning = {}
+            self._groups = {}
+        self._lib = None
+        self._features = None
+        self._info = None
+
+    @classmethod
+    def open(cls, path, layerName=None):
+        reader = UFOReader(path, validate=False)
+        if reader.formatVersionTuple < (3, 0):
+            # anchors are stored as contours in UFO 2 glyphs
+            import ufoLib2
+
+            font = ufoLib2.Font.open(path)
+            return font if layerName is None else font.layers[layerName]
+        return cls(path, layerName=layerName)
+
+    @classmethod
+    def fromLayoutData(cls, path, data, layerName=None):
+        """Make a font whose kerning, groups and glyphs are pre-populated from
+        the result of extractLayoutData."""
+        font = cls(path, layerName=layerName)
+        kerning, groups, glyphs = data
+        if layerName is None:
+            font._kerning = kerning
+            font._groups = groups
+        font._glyphs = {
+            glyphName: LayoutGlyph(
+                glyphName, list(unicodes), [LayoutAnchor(*a) for a in anchors]
+            )
+            for glyphName, (unicodes, anchors) in glyphs.items()
+        }
+        return font
+
+    def __repr__(self):
+        if self.layerName is not None:
+            return "<%s %r layer %r>" % (
+                self.__class__.__name__,
+                self.path,
+                self.layerName,
+            )
+        return "<%s %r>" % (self.__class__.__name__, self.path)
+
+    def layer(self, layerName):
+        """Return a LayoutFont reading the glyphs of another layer of this
+        UFO. The same object is returned for the same layer."""
+        if layerName is None or layerName == self.layerName:
+            return self
+        font = self._layers.get(layerName)
+        if font is None:
+            font = self._layers[layerName] = LayoutFont(self.path, layerName)
+        return font
+
+    @property
+    def kerning(self):
+        if self._kerning is None:
+            self._kerning = self._reader.readKerning(validate=False)
+        return self._kerning
+
+    @property
+    def groups(self):
+        if self._groups is None:
+            self._groups = self._reader.readGroups(validate=False)
+        return self._groups
+
+    @property
+    def lib(self):
+        if self._lib is None:
+            self._lib = self._reader.readLib(validate=False)
+        return self._lib
+
+    @property
+    def features(self):
+        if self._features is None:
+            self._features = SimpleNamespace(text=self._reader.readFeatures())
+        return self._features
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = SimpleNamespace()
+            self._reader.readInfo(self._info, validate=False)
+        return self._info
+
+    @property
+    def glyphOrder(self):
+        return list(self.lib.get("public.glyphOrder", []))
+
+    def fileSignature(self, fileName):
+        """Return a (modified time, size) tuple for a file inside the UFO, or
+        None if it doesn't exist."""
+        return _fileSignature(self._reader.fs, fileName)
+
+    def glyphSignature(self, glyphName):
+        """Return a (modified time, size) tuple for the glyph's .glif file."""
+        return _fileSignature(self._glyphSet.fs, self._glyphSet.contents[glyphName])
+
+    @property
+    def glyphsPath(self):
+        """The system path of the glyphs directory of the font's layer, or
+        None if the UFO isn't stored in a plain directory."""
+        try:
+            return self._glyphSet.fs.getsyspath("")
+        except fs.errors.NoSysPath:
+            return None
+
+    def glyphPath(self, glyphName):
+        """The system path of the glyph's .glif file, or None if the UFO
+        isn't stored in a plain directory."""
+        glyphsPath = self.glyphsPath
+        if glyphsPath is None:
+            return None
+        return os.path.join(glyphsPath, self._glyphSet.contents[glyphName])
+
+    def glyphNameForFile(self, fileName):
+        """Return the name of the glyph stored in the given .glif file name,
+        or None if it isn't listed in contents.plist."""
+        return self._glyphSet.getReverseContents().get(fileName.lower())
+
+    def invalidate(self, kerning=False, groups=False, glyphNames=()):
+        """Forget the cached kerning, groups or glyphs, so that they are read
+        again from disk on next access. Returns a dictionary of the glyphs
+        which had been loaded."""
+        if kerning and self.layerName is None:
+            self._kerning = None
+        if groups and self.layerName is None:
+            self._groups = None
+        dropped = {}
+        for glyphName in glyphNames:
+            glyph = self._glyphs.pop(glyphName, None)
+            if glyph is not None:
+                dropped[glyphName] = glyph
+        return dropped
+
+    def keys(self):
+        return self._glyphSet.keys()
+
+    def __iter__(self):
+        return iter(self._glyphSet.keys())
+
+    def __len__(self):
+        return len(self._glyphSet)
+
+    def __contains__(self, glyphName):
+        return glyphName in self._glyphSet
+
+    def __getitem__(self, glyphName):
+        glyph = self._glyphs.get(glyphName)
+        if glyph is None:
+            data = self._glyphSet.getGLIF(glyphName)
+            glyph = self._glyphs[glyphName] = parseLayoutGlyph(glyphName, data)
+        return glyph
+
+
+class LazyGlyphSet:
+    """An ordered glyph name to glyph mapping which only loads glyphs from
+    the font when they are accessed."""
+
+    def __init__(self, font, glyphOrder):
+        self.font = font
+        self.glyphOrder = glyphOrder
+        self._names = set(glyphOrder)
+
+    def __len__(self):
+        return len(self.glyphOrder)
+
+    def __iter__(self):
+        return iter(self.glyphOrder)
+
+    def __contains__(self, glyphName):
+        return glyphName in self._names
+
+    def __getitem__(self, glyphName):
+        return self.font[glyphName]
+
+    def keys(self):
+        return list(self.glyphOrder)
+
+    def values(self):
+        return [self.font[glyphName] for glyphName in self.glyphOrder]
+
+    def items(self):
+        return [(glyphName, self.font[glyphName]) for glyphName in self.glyphOrder]
+
+
+def sourceLayer(source):
+    """Return the glyphs of a designspace source: its font, or the layer of
+    its font named by the source's layerName."""
+    font = source.font
+    if source.layerName is None:
+        return font
+    if isinstance(font, LayoutFont):
+        return font.layer(source.layerName)
+    return font.layers[source.layerName]
+
+
+def extractGlyphData(glyph):
+    """Return the Unicode values and anchors of a glyph as plain tuples."""
+    return (
+        tuple(glyph.unicodes),
+        tuple((a.name, a.x, a.y) for a in glyph.anchors),
+    )
+
+
+def extractLayoutData(path, layerName=None):
+    """Read the kerning, groups, and the Unicode values and anchors of every
+    glyph of a UFO source into plain, picklable containers. For a layer, the
+    kerning and groups are empty."""
+    font = LayoutFont.open(path, layerName=layerName)
+    glyphs = {glyphName: extractGlyphData(font[glyphName]) for glyphName in font.keys()}
+    if layerName is not None:
+        return {}, {}, glyphs
+    return dict(font.kerning), {k: list(v) for k, v in font.groups.items()}, glyphs
+
+
+def loadSourceFonts(designspace, jobs=1, cache=None):
+    """Load the designspace sources as LayoutFonts.
+
+    If an ExtractionCache is given, each source's data is read through it.
+    With more than one job, each distinct source is extracted in a pool of
+    worker processes, and the results are assigned back to the sources in
+    designspace order.
+    """
+    if cache is None and (jobs is None or jobs <= 1):
+        # sources sharing a UFO share one font; see sourceLayer
+        return designspace.loadSourceFonts(opener=LayoutFont.open)
+    extract = cache.extract if cache is not None else extractLayoutData
+    keys = []
+    for source in designspace.sources:
+        key = (source.path, source.layerName)
+        if source.font is None and key not in keys:
+            keys.append(key)
+    paths = [path for path, _ in keys]
+    layerNames = [layerName for _, layerName in keys]
+    if jobs is None or jobs <= 1:
+        results = [extract(path, layerName) for path, layerName in keys]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(extract, paths, layerNames))
+    fonts = {}
+    for (path, layerName), data in zip(keys, results):
+        if layerName is None:
+            fonts[path] = LayoutFont.fromLayoutData(path, data)
+    for (path, layerName), data in zip(keys, results):
+        if layerName is not None:
+            if path not in fonts:
+                fonts[path] = LayoutFont(path)
+            fonts[path]._layers[layerName] = LayoutFont.fromLayoutData(
+                path, data, layerName=layerName
+            )
+    for source in designspace.sources:
+        if source.font is None:
+            source.font = fonts[source.path]
+    return [source.font for source in designspace.sources]
@@ -0,0 +1,276 @@
+from collections import Counter
+import threading
+
+from fontTools.feaLib.variableScalar import VariableScalar, Location
+from fontTools.varLib.models import VariationModel, normalizeValue
+from ufo2ft.util import quantize
+
+from .LayoutFont import sourceLayer
+
+
+class MasterLocations:
+    """Userspace locations of all the sources of a designspace.
+
+    The table is built once per designspace run and shared by all the
+    writers through the compiler object. Each source's location is stored
+    as a hashable VariableScalar location key (a sorted tuple of
+    (axisTag, userspace value) pairs), so that scalars built from it share
+    the same location objects. One VariationModel is cached per distinct
+    set of masters.
+
+    It also indexes which glyphs each source has, for sparse masters and
+    sources reading a layer of a UFO: layers() returns the glyphs of every
+    source, and glyphNames(column) the names of those a source defines.
+
+    Scalars are interned: makeScalar returns the same VariableScalar object
+    for the same masters and values, so the kern and mark writers share one
+    object per distinct variation; VariableScalar compares by identity, so
+    this also makes equal scalars compare equal, also between writers
+    running in threads, as interning holds a lock. quantizeScalar keeps the
+    quantized variants which aren't already among them apart, in
+    quantizedScalars, so that scalars, locationSets and scalarRequests
+    only count what the writers asked for.
+
+    With a non-zero tolerance, makeScalar drops the values of masters which
+    the remaining ones already interpolate to within that many units, so
+    they don't add deltas (and VarStore regions and rows) of their own.
+    Interpolation is checked on the normalized design locations, where the
+    font interpolates, rather than on the userspace ones.
+    """
+
+    def __init__(self, designspace, tolerance=0):
+        self.axes = designspace.axes
+        self.axisTags = {axis.name: axis.tag for axis in self.axes}
+        self._axesByName = {axis.name: axis for axis in self.axes}
+        self.sources = designspace.sources
+        self.locations = [self.userLocation(s.location) for s in self.sources]
+        self.keys = [Location(location) for location in self.locations]
+        self._columns = {key: column for column, key in enumerate(self.keys)}
+        self.normalized = [self.normalizeLocation(s.location) for s in self.sources]
+        self._models = {}
+        # the distinct sets of sources scalars have been made from
+        self.locationSets = set()
+        # interned scalars keyed by (columns, values): those the writers
+        # asked for, and the quantized variants of them which are new
+        self.scalars = {}
+        self.quantizedScalars = {}
+        self.scalarRequests = 0
+        self.tolerance = tolerance
+        self.defaultColumn = next(
+            (i for i, l in enumerate(self.normalized) if not any(l.values())),
+            None,
+        )
+        self.defaultKey = (
+            self.keys[self.defaultColumn] if self.defaultColumn is not None else None
+        )
+        # try to drop intermediate masters first, then those off-axis, and
+        # the axis extremes last
+        self._pruneOrder = sorted(
+            (i for i in range(len(self.sources)) if i != self.defaultColumn),
+            key=lambda i: (
+                -sum(0 < abs(v) < 1 for v in self.normalized[i].values()),
+                -sum(v != 0 for v in self.normalized[i].values()),
+                -i,
+            ),
+        )
+        self.pruned = Counter()
+        # writers may run in threads at the same time; interning must give
+        # them the same object for the same key
+        self._lock = threading.Lock()
+        self._layers = None
+        self._glyphNames = {}
+
+    def __len__(self):
+        return len(self.sources)
+
+    def popResults(self):
+        """Return the location sets, interned scalars, scalar request count
+        and pruning counts accumulated so far, and start again from empty,
+        so that a table used in another process can report what it added."""
+        results = (
+            self.locationSets,
+            self.scalars,
+            self.quantizedScalars,
+            self.scalarRequests,
+            self.pruned,
+        )
+        self.locationSets = set()
+        self.scalars = {}
+        self.quantizedScalars = {}
+        self.scalarRequests = 0
+        self.pruned = Counter()
+        return results
+
+    def addResults(self, results):
+        """Add the results returned by popResults on another table."""
+        locationSets, scalars, quantizedScalars, scalarRequests, pruned = results
+        self.locationSets |= locationSets
+        for key, scalar in scalars.items():
+            self.scalars.setdefault(key, scalar)
+        for key, scalar in quantizedScalars.items():
+            self.quantizedScalars.setdefault(key, scalar)
+        self.scalarRequests += scalarRequests
+        self.pruned.update(pruned)
+
+    def layers(self):
+        """Return the glyphs (font or font layer) of every source."""
+        if self._layers is None:
+            self._layers = [sourceLayer(source) for source in self.sources]
+        return self._layers
+
+    def glyphNames(self, column):
+        """Return the set of glyph names defined by a source."""
+        names = self._glyphNames.get(column)
+        if names is None:
+            names = self._glyphNames[column] = frozenset(self.layers()[column].keys())
+        return names
+
+    def userLocation(self, location):
+        """Convert a designspace location keyed by axis name to a userspace
+        location keyed by axis tag."""
+        axes = self._axesByName
+        return {
+            axes[name].tag: axes[name].map_backward(value)
+            for name, value in location.items()
+        }
+
+    def userRange(self, name, minimum, maximum):
+        """Convert the designspace range of a rule condition on the axis of
+        the given name to a userspace range keyed by axis tag. Unbounded
+        ends stay None."""
+        axis = self._axesByName[name]
+        return axis.tag, tuple(
+            None if value is None else axis.map_backward(value)
+            for value in (minimum, maximum)
+        )
+
+    def normalizeLocation(self, location):
+        """Normalize a designspace location keyed by axis name to one keyed
+        by axis tag. The design coordinates are normalized, as the font
+        interpolates after the axis maps are applied."""
+        result = {}
+        for axis in self.axes:
+            triple = tuple(
+                axis.map_forward(value)
+                for value in (axis.minimum, axis.default, axis.maximum)
+            )
+            value = location.get(axis.name, triple[1])
+            result[axis.tag] = normalizeValue(value, triple)
+        return result
+
+    def makeScalar(self, columns, values):
+        """Return a VariableScalar with the given values at the locations of
+        the sources at the given indices. If pruning leaves only the default
+        master, return its value instead."""
+        with self._lock:
+            self.scalarRequests += 1
+        if self.tolerance:
+            columns, values = self.prune(columns, values)
+            if len(columns) == 1:
+                return values[0]
+        columns = tuple(int(c) for c in columns)
+        key = (columns, tuple(values))
+        with self._lock:
+            self.locationSets.add(columns)
+            if key in self.quantizedScalars:
+                # quantized from another scalar first; it's asked for now
+                self.scalars[key] = self.quantizedScalars.pop(key)
+            return self._intern(self.scalars, *key)
+
+    def _intern(self, scalars, columns, values):
+        # callers hold self._lock
+        scalar = scalars.get((columns, values))
+        if scalar is None:
+            scalar = VariableScalar()
+            scalar.values = {self.keys[c]: v for c, v in zip(columns, values)}
+            scalars[columns, values] = scalar
+        return scalar
+
+    def prune(self, columns, values):
+        """Return the columns and values left after dropping the masters that
+        the others interpolate to within the tolerance. The default master
+        is always kept; if it's not among the columns, nothing is dropped."""
+        columns = [int(c) for c in columns]
+        pruned = Counter(deltasBefore=len(columns) - 1)
+        if self.defaultColumn not in columns or len(columns) < 3:
+            pruned["deltasAfter"] += len(columns) - 1
+            with self._lock:
+                self.pruned.update(pruned)
+            return columns, values
+        valueOf = dict(zip(columns, values))
+        kept = set(columns)
+        dropped = []
+        for column in self._pruneOrder:
+            if column not in kept:
+                continue
+            candidate = sorted(kept - {column})
+            model = self.model(candidate)
+            masterValues = [valueOf[c] for c in candidate]
+            if all(
+                abs(
+                    model.interpolateFromMasters(self.normalized[d], masterValues)
+                    - valueOf[d]
+                )
+                <= self.tolerance
+                for d in dropped + [column]
+            ):
+                kept.discard(column)
+                dropped.append(column)
+        columns = sorted(kept)
+        pruned["mastersDropped"] += len(dropped)
+        pruned["deltasAfter"] += len(columns) - 1
+        if len(columns) == 1:
+            pruned["scalarsCollapsed"] += 1
+        with self._lock:
+            self.pruned.update(pruned)
+        return columns, [valueOf[c] for c in columns]
+
+    def quantizeScalar(self, scalar, quantization=1, deltaQuantization=0):
+        """Round each master value of a scalar to a multiple of quantization
+        and, with a deltaQuantization, each master's difference from the
+        default master to a multiple of that, so that near-identical
+        variations share the same deltas. Return a number instead if all the
+        values end up equal."""
+        values = {
+            location: quantize(value, quantization)
+            for location, value in scalar.values.items()
+        }
+        default = values.get(self.defaultKey)
+        if deltaQuantization and default is not None:
+            values = {
+                location: default + quantize(value - default, deltaQuantization)
+                for location, value in values.items()
+            }
+        if len(set(values.values())) == 1:
+            return next(iter(values.values()))
+        columns = tuple(self._columns.get(location) for location in values)
+        if None in columns:
+            result = VariableScalar()
+            result.values = values
+            return result
+        key = (columns, tuple(values.values()))
+        with self._lock:
+            if key in self.scalars:
+                # unchanged by quantization, or the same as another scalar
+                return self.scalars[key]
+            return self._intern(self.quantizedScalars, *key)
+
+    def model(self, columns):
+        """Return the VariationModel for the sources at the given indices."""
+        columns = tuple(columns)
+        model = self._models.get(columns)
+        if model is None:
+            model = VariationModel([self.normalized[c] for c in columns])
+            self._models[columns] = model
+        return model
+
+
+def getMasterLocations(designspace, compiler=None):
+    """Return the MasterLocations table stored on the compiler, building and
+    storing it there if it doesn't exist yet."""
+    masterLocations = getattr(compiler, "masterLocations", None)
+    if masterLocations is None:
+        masterLocations = MasterLocations(designspace)
+        if compiler is not None:
+            compiler.masterLocations = masterLocations
+    return masterLocations
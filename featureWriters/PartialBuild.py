@@ -0,0 +1,68 @@
+from fontTools import unicodedata
+
+# glyphs of these scripts are shared by all scripts
+COMMON_SCRIPTS = frozenset(["Zyyy", "Zinh"])
+
+
+def readGlyphList(path):
+    """Read glyph names from a text file, one per line or separated by
+    spaces; '#' starts a comment."""
+    names = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            names.extend(line.split("#", 1)[0].split())
+    return names
+
+
+class PartialBuild:
+    """Restrict feature generation to some features, scripts or glyphs.
+
+    features limits the writers to those tags (e.g. "kern", "mark", "mkmk",
+    "rvrn"); writers with none of them don't run. scripts (OpenType script
+    tags) and glyphs limit the glyph set the writers work on, so the
+    kerning, anchors and rules of the other glyphs are never turned into
+    lookups or scalars. With scripts, glyphs whose Unicode values belong to
+    other scripts are left out; common and inherited characters (digits,
+    punctuation, combining marks) and unencoded glyphs are kept.
+    """
+
+    def __init__(self, features=None, scripts=None, glyphs=None):
+        self.features = frozenset(features) if features is not None else None
+        self.scripts = frozenset(scripts) if scripts is not None else None
+        self.glyphs = frozenset(glyphs) if glyphs is not None else None
+
+    def filterWriters(self, writers):
+        """Return the writers which write any of the selected features,
+        each limited to those features."""
+        if self.features is None:
+            return writers
+        result = []
+        for writer in writers:
+            features = writer.features & self.features
+            if features:
+                writer.features = features
+                result.append(writer)
+        return result
+
+    def _scriptMatches(self, glyph):
+        if not glyph.unicodes:
+            return True
+        for unicode in glyph.unicodes:
+            codes = unicodedata.script_extension(chr(unicode))
+            if codes <= COMMON_SCRIPTS:
+                return True
+            for code in codes:
+                if self.scripts.intersection(unicodedata.ot_tags_from_script(code)):
+                    return True
+        return False
+
+    def glyphOrder(self, font, glyphOrder):
+        """Return the glyph names of glyphOrder selected by the glyph and
+        script filters, in the same order."""
+        if self.glyphs is not None:
+            glyphOrder = [name for name in glyphOrder if name in self.glyphs]
+        if self.scripts is not None:
+            glyphOrder = [
+                name for name in glyphOrder if self._scriptMatches(font[name])
+            ]
+        return glyphOrder
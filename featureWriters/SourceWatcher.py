@@ -0,0 +1,150 @@
+from fontTools.designspaceLib import DesignSpaceDocument
+from .LayoutFont import (
+    DEFAULT_SOURCE_FILES,
+    GLYPH_SET_FILES,
+    LayoutFont,
+    extractGlyphData,
+    sourceLayer,
+)
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+
+def _scanDirectory(path):
+    result = {}
+    if path is None or not os.path.isdir(path):
+        return result
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                result[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return result
+
+
+def _changedFiles(old, new):
+    names = old.keys() | new.keys()
+    return {name for name in names if old.get(name) != new.get(name)}
+
+
+def _sourcesKey(designspace):
+    axes = [
+        (a.name, a.tag, a.minimum, a.default, a.maximum, a.map)
+        for a in designspace.axes
+    ]
+    sources = [
+        (s.path, s.layerName, sorted(s.location.items())) for s in designspace.sources
+    ]
+    return axes, sources
+
+
+class SourceWatcher:
+    """Poll a designspace and its loaded LayoutFont sources for changes.
+
+    Each call to poll() compares the modification times and sizes of the
+    designspace file, the top level files of every source and the .glif
+    files of its layer against the previous call. Changed kerning, groups
+    and glyphs are invalidated in the fonts, and the kinds of layout data
+    that actually changed are returned, so the caller can rerun only the
+    writers which depend on them:
+
+    - "kerning", "groups": the kerning.plist or groups.plist of a source;
+    - "anchors", "unicodes": the anchors or Unicode values of a glyph;
+    - "rules": the designspace rules;
+    - "reload": anything else which requires loading everything again,
+      e.g. a glyph being added or removed, the default source's features
+      or lib, or the axes and sources of the designspace.
+
+    Edits which don't touch layout data, like outline-only changes to a
+    glyph, produce no changes.
+    """
+
+    def __init__(self, designspace):
+        self.designspace = designspace
+        self._snapshot = self._scan()
+
+    def _fonts(self):
+        fonts = []
+        for source in self.designspace.sources:
+            # the font, and for a layer source the layer holding its glyphs
+            for font in (source.font, sourceLayer(source)):
+                if font not in fonts:
+                    fonts.append(font)
+        return fonts
+
+    def _scan(self):
+        snapshot = {None: _scanDirectory(os.path.dirname(self.designspace.path))}
+        for font in self._fonts():
+            if isinstance(font, LayoutFont):
+                glyphs = _scanDirectory(font.glyphsPath)
+            else:
+                glyphs = {}
+            snapshot[id(font)] = (_scanDirectory(font.path), glyphs)
+        return snapshot
+
+    def poll(self):
+        old, new = self._snapshot, self._scan()
+        self._snapshot = new
+        changes = set()
+
+        designspaceName = os.path.basename(self.designspace.path)
+        if designspaceName in _changedFiles(old[None], new[None]):
+            changes |= self._designspaceChanged()
+            if "reload" in changes:
+                return changes
+
+        defaultFont = self.designspace.findDefault().font
+        for font in self._fonts():
+            oldTop, oldGlyphs = old[id(font)]
+            newTop, newGlyphs = new[id(font)]
+            topFiles = _changedFiles(oldTop, newTop)
+            glyphFiles = _changedFiles(oldGlyphs, newGlyphs)
+            if not topFiles and not glyphFiles:
+                continue
+            if not isinstance(font, LayoutFont):
+                return {"reload"}
+            if glyphFiles & GLYPH_SET_FILES:
+                return {"reload"}
+            if font is defaultFont and topFiles & DEFAULT_SOURCE_FILES:
+                return {"reload"}
+            if "kerning.plist" in topFiles:
+                font.invalidate(kerning=True)
+                changes.add("kerning")
+            if "groups.plist" in topFiles:
+                font.invalidate(groups=True)
+                changes.add("groups")
+            for fileName in glyphFiles:
+                if not fileName.endswith(".glif"):
+                    continue
+                glyphName = font.glyphNameForFile(fileName)
+                if glyphName is None:
+                    continue
+                changes |= self._glyphChanged(font, glyphName)
+        return changes
+
+    def _glyphChanged(self, font, glyphName):
+        oldGlyph = font.invalidate(glyphNames=[glyphName]).get(glyphName)
+        if oldGlyph is None:
+            return {"anchors", "unicodes"}
+        oldUnicodes, oldAnchors = extractGlyphData(oldGlyph)
+        newUnicodes, newAnchors = extractGlyphData(font[glyphName])
+        changes = set()
+        if oldUnicodes != newUnicodes:
+            changes.add("unicodes")
+        if oldAnchors != newAnchors:
+            changes.add("anchors")
+        return changes
+
+    def _designspaceChanged(self):
+        try:
+            document = DesignSpaceDocument.fromfile(self.designspace.path)
+        except Exception as e:
+            log.warning("could not read %s: %s", self.designspace.path, e)
+            return set()
+        if _sourcesKey(document) != _sourcesKey(self.designspace):
+            return {"reload"}
+        self.designspace.rules = document.rules
+        self.designspace.rulesProcessingLast = document.rulesProcessingLast
+        return {"rules"}
@@ -4,21 +4,103 @@ from ufo2ft.featureWriters.kernFeatureWriter import (
     SIDE2_PREFIX,
     KerningPair,
 )
+from ufo2ft.util import quantize
 from itertools import chain
 from fontTools.feaLib.variableScalar import VariableScalar
 from fontTools.feaLib import ast
 import logging
+from types import SimpleNamespace
+import numpy as np
+
+from .BuildStats import getStats
+from .DeferredStatement import DeferredStatement
+from .LayoutFont import toNumber
+from .MasterLocations import MasterLocations, getMasterLocations
 
 log = logging.getLogger(__file__)
 
 
-def get_location(designspace, location):
-    axis_map = {axis.name: axis.tag for axis in designspace.axes}
-    axis_to_userspace = {axis.name: axis.map_backward for axis in designspace.axes}
-    return {axis_map[name]: axis_to_userspace[name](v) for name, v in location.items()}
+def _lazySet(slot):
+    # a property over one of KerningPair's slots, which makes the set the
+    # first time it's read
+    def get(pair):
+        try:
+            return slot.__get__(pair)
+        except AttributeError:
+            value = set()
+            slot.__set__(pair, value)
+            return value
+
+    return property(get, slot.__set__)
+
+
+class VariableKerningPair(KerningPair):
+    """A KerningPair made from AST nodes for its sides, shared by all the
+    pairs with the same glyph or class on that side. The directions and
+    bidiTypes sets, which most pairs never use, are only made when read."""
+
+    __slots__ = ()
+
+    directions = _lazySet(KerningPair.directions)
+    bidiTypes = _lazySet(KerningPair.bidiTypes)
+
+    def __init__(self, side1, side2, value):
+        self.side1 = side1
+        self.side2 = side2
+        self.value = value
+
+
+def _makePairPosStatement(side1, side2, value, enumerated, rtl):
+    valuerecord = ast.ValueRecord(
+        xPlacement=value if rtl else None,
+        yPlacement=0 if rtl else None,
+        xAdvance=value,
+        yAdvance=0 if rtl else None,
+    )
+    return ast.PairPosStatement(
+        glyphs1=side1,
+        valuerecord1=valuerecord,
+        glyphs2=side2,
+        valuerecord2=None,
+        enumerated=enumerated,
+    )
 
 
 class VariableKernWriter(KernFeatureWriter):
+    """Variable kerning writer.
+
+    The quantization option rounds every master value of a variable kern
+    value; with deltaQuantization, each master's difference from the default
+    master is also rounded to a multiple of it, so that pairs with nearly
+    the same variation share VarStore rows.
+
+    The pos rules are DeferredStatements: their AST is only made when the
+    feature file is written out or compiled.
+    """
+
+    # the kinds of source data this writer reads; see SourceWatcher
+    dependsOn = frozenset(["kerning", "groups", "unicodes"])
+    options = dict(KernFeatureWriter.options, deltaQuantization=0)
+
+    def getKerningData(self, designspace, feaFile=None, glyphSet=None):
+        side1Classes, side2Classes = self.getKerningClasses(
+            designspace, feaFile, glyphSet
+        )
+        compiler = self.context.compiler
+        masterLocations = getMasterLocations(designspace, compiler)
+        self.context.masterLocations = masterLocations
+        pairs = self.getKerningPairs(
+            designspace,
+            side1Classes,
+            side2Classes,
+            glyphSet,
+            masterLocations,
+            stats=getStats(compiler),
+        )
+        return SimpleNamespace(
+            side1Classes=side1Classes, side2Classes=side2Classes, pairs=pairs
+        )
+
     @staticmethod
     def getKerningGroups(designspace, glyphSet=None):
         if glyphSet:
@@ -28,6 +110,9 @@ class VariableKernWriter(KernFeatureWriter):
         side1Groups = {}
         side2Groups = {}
         for source in designspace.sources:
+            if source.layerName is not None:
+                # sparse layer sources have no groups of their own
+                continue
             font = source.font
             for name, members in font.groups.items():
                 # prune non-existent or skipped glyphs
@@ -61,66 +146,139 @@ class VariableKernWriter(KernFeatureWriter):
         return side1Groups, side2Groups
 
     @staticmethod
-    def getKerningPairs(designspace, side1Classes, side2Classes, glyphSet=None):
-        default_font = designspace.findDefault().font
-        if glyphSet:
-            allGlyphs = set(glyphSet.keys())
-        else:
-            allGlyphs = set(default_font)
+    def getKerningMatrix(designspace, side1Classes, side2Classes, allGlyphs):
+        """Read every source's kerning once into a pairs x masters matrix.
 
-        pairsByFlags = {}
-        for source in designspace.sources:
-            for (side1, side2) in source.font.kerning:
+        Returns a tuple (pairs, values, mask), where pairs is a list of
+        (flags, side1, side2) tuples sorted in output order, values is a
+        float array of shape (len(pairs), len(sources)) and mask marks the
+        cells for which the source actually defines a value. The default
+        master is filled with zero for pairs it doesn't define; sources
+        reading a layer of a UFO are sparse, and never define kerning.
+        """
+        sources = designspace.sources
+        default_source = designspace.findDefault()
+
+        pairIndices = {}
+        columns = []
+        for source in sources:
+            rows = []
+            cells = []
+            if source.layerName is not None:
+                columns.append((rows, cells))
+                continue
+            for (side1, side2), kernValue in source.font.kerning.items():
                 # filter out pairs that reference missing groups or glyphs
                 if side1 not in side1Classes and side1 not in allGlyphs:
                     continue
                 if side2 not in side2Classes and side2 not in allGlyphs:
                     continue
-                flags = (side1 in side1Classes, side2 in side2Classes)
-                pairsByFlags.setdefault(flags, set()).add((side1, side2))
+                index = pairIndices.get((side1, side2))
+                if index is None:
+                    index = pairIndices[side1, side2] = len(pairIndices)
+                rows.append(index)
+                cells.append(kernValue)
+            columns.append((rows, cells))
+
+        values = np.zeros((len(pairIndices), len(sources)))
+        mask = np.zeros((len(pairIndices), len(sources)), dtype=bool)
+        for column, (rows, cells) in enumerate(columns):
+            values[rows, column] = cells
+            mask[rows, column] = True
+            if sources[column] is default_source:
+                # pairs missing from the default master are implicitly zero
+                mask[:, column] = True
+
+        pairs = [
+            ((side1 in side1Classes, side2 in side2Classes), side1, side2)
+            for side1, side2 in pairIndices
+        ]
+        order = sorted(range(len(pairs)), key=pairs.__getitem__)
+        return [pairs[i] for i in order], values[order], mask[order]
+
+    @staticmethod
+    def getKerningPairs(
+        designspace,
+        side1Classes,
+        side2Classes,
+        glyphSet=None,
+        masterLocations=None,
+        stats=None,
+    ):
+        if masterLocations is None:
+            masterLocations = MasterLocations(designspace)
+        if glyphSet:
+            allGlyphs = set(glyphSet.keys())
+        else:
+            allGlyphs = set(designspace.findDefault().font)
+
+        pairs, values, mask = VariableKernWriter.getKerningMatrix(
+            designspace, side1Classes, side2Classes, allGlyphs
+        )
+        if not pairs:
+            return []
+
+        # the first value actually defined by any master, for every pair
+        first = values[np.arange(len(pairs)), mask.argmax(axis=1)]
+        constant = np.all(~mask | (values == first[:, None]), axis=1)
+        bothClasses = np.array([all(flags) for flags, _, _ in pairs])
+        # ignore zero-valued class kern pairs
+        keep = ~(bothClasses & constant & (first == 0))
+        if stats is not None:
+            stats.count("kern.pairsSeen", len(pairs))
+            stats.count("kern.pairsConstant", constant.sum())
+            stats.count("kern.zeroClassPairsDropped", len(pairs) - keep.sum())
+            stats.count("kern.pairsEmitted", keep.sum())
+
+        # one AST node per glyph or class on each side, shared by its pairs
+        side1Nodes = {}
+        side2Nodes = {}
+
+        def node(nodes, side, isClass, classes):
+            result = nodes.get(side)
+            if result is None:
+                if isClass:
+                    result = ast.GlyphClassName(classes[side])
+                else:
+                    result = ast.GlyphName(side)
+                nodes[side] = result
+            return result
 
         result = []
-        for flags, pairs in sorted(pairsByFlags.items()):
-            for side1, side2 in sorted(pairs):
-                value = VariableScalar()
-                for source in designspace.sources:
-                    if (side1, side2) in source.font.kerning:
-                        location = get_location(designspace, source.location)
-                        value.add_value(location, source.font.kerning[side1, side2])
-                    elif source.font == default_font:
-                        location = get_location(designspace, source.location)
-                        value.add_value(location, 0)
-                values = list(value.values.values())
-                if not any(v != values[0] for v in values[1:]):
-                    value = list(value.values.values())[0]
-                if all(flags) and value == 0:
-                    # ignore zero-valued class kern pairs
-                    continue
-                firstIsClass, secondIsClass = flags
-                if firstIsClass:
-                    side1 = side1Classes[side1]
-                if secondIsClass:
-                    side2 = side2Classes[side2]
-                result.append(KerningPair(side1, side2, value))
+        for i in np.flatnonzero(keep):
+            (firstIsClass, secondIsClass), side1, side2 = pairs[i]
+            if constant[i]:
+                value = toNumber(first[i])
+            else:
+                columns = np.flatnonzero(mask[i])
+                value = masterLocations.makeScalar(
+                    columns, [toNumber(v) for v in values[i, columns]]
+                )
+            result.append(
+                VariableKerningPair(
+                    node(side1Nodes, side1, firstIsClass, side1Classes),
+                    node(side2Nodes, side2, secondIsClass, side2Classes),
+                    value,
+                )
+            )
         return result
 
-    @staticmethod
-    def _makePairPosRule(pair, rtl=False, quantization=1):
+    def _makePairPosRule(self, pair, rtl=False, quantization=1):
         enumerated = pair.firstIsClass ^ pair.secondIsClass
         value = pair.value
+        if isinstance(value, VariableScalar):
+            value = self.context.masterLocations.quantizeScalar(
+                value, quantization, self.options.deltaQuantization
+            )
+            if not isinstance(value, VariableScalar):
+                stats = getStats(self.context.compiler)
+                if stats is not None:
+                    stats.count("kern.pairsConstantAfterQuantization")
+        else:
+            value = quantize(value, quantization)
         if rtl and "L" in pair.bidiTypes:
             # numbers are always shaped LTR even in RTL scripts
             rtl = False
-        valuerecord = ast.ValueRecord(
-            xPlacement=value if rtl else None,
-            yPlacement=0 if rtl else None,
-            xAdvance=value,
-            yAdvance=0 if rtl else None,
-        )
-        return ast.PairPosStatement(
-            glyphs1=pair.side1,
-            valuerecord1=valuerecord,
-            glyphs2=pair.side2,
-            valuerecord2=None,
-            enumerated=enumerated,
+        return DeferredStatement(
+            _makePairPosStatement, pair.side1, pair.side2, value, enumerated, rtl
         )
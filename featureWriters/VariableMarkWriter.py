@@ -1,10 +1,18 @@
 from ufo2ft.featureWriters import MarkFeatureWriter, BaseFeatureWriter, ast
 from types import SimpleNamespace
-from fontTools.feaLib.variableScalar import VariableScalar
 from collections import OrderedDict, defaultdict
+import numpy as np
+
+from .BuildStats import getStats
+from .DeferredStatement import DeferredStatement
+from .LayoutFont import toNumber
+from .MasterLocations import getMasterLocations
 
 
 class VariableMarkWriter(MarkFeatureWriter):
+    # the kinds of source data this writer reads; see SourceWatcher
+    dependsOn = frozenset(["anchors", "unicodes"])
+
     def setContext(self, *args, **kwargs):
         # Rename "font" to "designspace" to avoid confusion
         super(MarkFeatureWriter, self).setContext(*args, **kwargs)
@@ -16,41 +24,113 @@ class VariableMarkWriter(MarkFeatureWriter):
             insertComments=self.context.insertComments,
         )
         self.context.font = self.context.designspace.findDefault().font
-        self.context.axis_map = {
-            axis.name: axis.tag for axis in self.context.designspace.axes
-        }
-        self.context.axis_to_userspace = {
-            axis.name: axis.map_backward for axis in self.context.designspace.axes
-        }
+        self.context.masterLocations = getMasterLocations(
+            self.context.designspace, self.context.compiler
+        )
         self.context.gdefClasses = self.getGDEFGlyphClasses()
         self.context.anchorLists = self._getAnchorLists()
         self.context.anchorPairs = self._getAnchorPairs()
         self.context.feaScripts = set(ast.getScriptLanguageSystems(self.context.feaFile).keys())
         return self.context
 
-    def get_location(self, location):
-        return {
-            self.context.axis_map[name]: self.context.axis_to_userspace[name](v)
-            for name, v in location.items()
-        }
+    def _buildAnchorIndex(self, glyphNames):
+        """Collect the anchors of the given glyphs from every source in one
+        pass per source.
+
+        Returns a namespace with 'rows', mapping (glyphName, anchorName) to
+        a row index, 'values', an array of shape (rows, sources, 2) holding
+        the (x, y) position of each anchor in each master, 'mask', marking
+        which masters define the anchor, and 'present', marking which
+        masters define the anchor's glyph. Sparse masters only contribute
+        the glyphs they have.
+        """
+        sources = self.context.designspace.sources
+        masterLocations = self.context.masterLocations
+        layers = masterLocations.layers()
+        rows = {}
+        rowGlyphs = []
+        columns = []
+        for column, layer in enumerate(layers):
+            members = masterLocations.glyphNames(column)
+            cells = []
+            for glyphName in glyphNames:
+                if glyphName not in members:
+                    continue
+                for anchor in layer[glyphName].anchors:
+                    if not anchor.name:
+                        continue
+                    key = (glyphName, anchor.name)
+                    row = rows.get(key)
+                    if row is None:
+                        row = rows[key] = len(rows)
+                        rowGlyphs.append(glyphName)
+                    cells.append((row, anchor.x, anchor.y))
+            columns.append(cells)
+
+        values = np.zeros((len(rows), len(sources), 2))
+        mask = np.zeros((len(rows), len(sources)), dtype=bool)
+        for column, cells in enumerate(columns):
+            if not cells:
+                continue
+            indices, xs, ys = zip(*cells)
+            values[indices, column, 0] = xs
+            values[indices, column, 1] = ys
+            mask[indices, column] = True
 
-    def _maybeNonVariable(self, varscalar):
-        values = list(varscalar.values.values())
-        if not any(v != values[0] for v in values[1:]):
-            return list(varscalar.values.values())[0]
-        return varscalar
+        present = np.array(
+            [
+                [glyphName in masterLocations.glyphNames(c) for c in range(len(sources))]
+                for glyphName in rowGlyphs
+            ],
+            dtype=bool,
+        ).reshape(len(rows), len(sources))
+
+        if len(rows):
+            first = values[np.arange(len(rows)), mask.argmax(axis=1)]
+            constant = np.all(~mask[:, :, None] | (values == first[:, None]), axis=1)
+        else:
+            first = np.zeros((0, 2))
+            constant = np.zeros((0, 2), dtype=bool)
+        return SimpleNamespace(
+            rows=rows,
+            values=values,
+            mask=mask,
+            present=present,
+            first=first,
+            constant=constant,
+        )
 
     def _getAnchor(self, glyphName, anchorName):
-        x_value = VariableScalar()
-        y_value = VariableScalar()
-        for source in self.context.designspace.sources:
-            glyph = source.font[glyphName]
-            for anchor in glyph.anchors:
-                if anchor.name == anchorName:
-                    location = self.get_location(source.location)
-                    x_value.add_value(location, anchor.x)
-                    y_value.add_value(location, anchor.y)
-        return self._maybeNonVariable(x_value), self._maybeNonVariable(y_value)
+        index = self.context.anchorIndex
+        row = index.rows[glyphName, anchorName]
+        mask = index.mask[row]
+        # sparse masters without the glyph don't count as missing the anchor
+        missingFrom = index.present[row] & ~mask
+        if missingFrom.any():
+            missing = [
+                source.name or source.filename
+                for source, missed in zip(self.context.designspace.sources, missingFrom)
+                if missed
+            ]
+            self.log.warning(
+                "anchor '%s' in glyph '%s' is missing from sources: %s",
+                anchorName,
+                glyphName,
+                ", ".join(missing),
+            )
+        result = []
+        for axis in (0, 1):
+            if index.constant[row, axis]:
+                result.append(toNumber(index.first[row, axis]))
+                continue
+            columns = np.flatnonzero(mask)
+            result.append(
+                self.context.masterLocations.makeScalar(
+                    columns,
+                    [toNumber(v) for v in index.values[row, columns, axis]],
+                )
+            )
+        return tuple(result)
 
     def _getAnchorLists(self):
         gdefClasses = self.context.gdefClasses
@@ -60,10 +140,18 @@ class VariableMarkWriter(MarkFeatureWriter):
         else:
             # no GDEF table defined in feature file, include all glyphs
             include = None
+        glyphSet = OrderedDict(
+            (glyphName, glyph)
+            for glyphName, glyph in self.getOrderedGlyphSet().items()
+            if include is None or glyphName in include
+        )
+        self.context.anchorIndex = index = self._buildAnchorIndex(glyphSet)
+        stats = getStats(self.context.compiler)
+        if stats is not None:
+            stats.count("mark.anchors", len(index.rows))
+            stats.count("mark.anchorsConstant", index.constant.all(axis=1).sum())
         result = OrderedDict()
-        for glyphName, glyph in self.getOrderedGlyphSet().items():
-            if include is not None and glyphName not in include:
-                continue
+        for glyphName, glyph in glyphSet.items():
             anchorDict = OrderedDict()
             for anchor in glyph.anchors:
                 anchorName = anchor.name
@@ -106,6 +194,9 @@ class VariableMarkWriter(MarkFeatureWriter):
                     # same mark glyph defined with different anchors for the
                     # same markClass; make a new unique markClass definition
                     newClassName = ast.makeFeaClassName(className, markClasses)
+                    stats = getStats(self.context.compiler)
+                    if stats is not None:
+                        stats.count("mark.markClassesSplit")
                     markClass = ast.MarkClass(newClassName)
                     markClasses[newClassName] = markClass
         glyphName = ast.GlyphName(glyphName)
@@ -208,8 +299,14 @@ class AbstractMarkPos:
     Provides methods to filter marks given some callable, and convert
     itself to feaLib AST 'pos' statements for mark2base, mark2liga and
     mark2mark lookups.
+
+    The writer puts the DeferredStatement returned by asAST() in its
+    lookups, so the statement and its anchors are only made when the
+    feature file is written out or compiled.
     """
 
+    __slots__ = ("name", "marks")
+
     Statement = None
 
     def __init__(self, name, marks):
@@ -225,12 +322,15 @@ class AbstractMarkPos:
             for anchor in sorted(self.marks, key=lambda a: a.name)
         ]
 
-    def asAST(self):
+    def makeStatement(self):
         marks = self._marksAsAST()
         return self.Statement(ast.GlyphName(self.name), marks)
 
+    def asAST(self):
+        return DeferredStatement(self.makeStatement)
+
     def __str__(self):
-        return self.asAST().asFea()  # pragma: no cover
+        return self.makeStatement().asFea()  # pragma: no cover
 
     def filter(self, include):
         marks = self._filterMarks(include)
@@ -247,16 +347,22 @@ class AbstractMarkPos:
 
 class MarkToBasePos(AbstractMarkPos):
 
+    __slots__ = ()
+
     Statement = ast.MarkBasePosStatement
 
 
 class MarkToMarkPos(AbstractMarkPos):
 
+    __slots__ = ()
+
     Statement = ast.MarkMarkPosStatement
 
 
 class MarkToLigaPos(AbstractMarkPos):
 
+    __slots__ = ()
+
     Statement = ast.MarkLigPosStatement
 
     def _filterMarks(self, include):
@@ -1,11 +1,107 @@
 from ufo2ft.featureWriters import BaseFeatureWriter
 from types import SimpleNamespace
-from fontTools.feaLib.variableScalar import VariableScalar
 from fontTools.feaLib import ast
 from collections import OrderedDict, defaultdict
 
+from .BuildStats import getStats
+from .MasterLocations import getMasterLocations
+
+
+def _bounds(range_):
+    minimum, maximum = range_
+    return (
+        float("-inf") if minimum is None else minimum,
+        float("inf") if maximum is None else maximum,
+    )
+
+
+def _contains(box, other):
+    """True if every location matching the condition set 'other' also
+    matches 'box'. Axes missing from a condition set are unbounded."""
+    for tag, range_ in box.items():
+        if tag not in other:
+            return False
+        minimum, maximum = _bounds(range_)
+        otherMin, otherMax = _bounds(other[tag])
+        if otherMin < minimum or otherMax > maximum:
+            return False
+    return True
+
+
+def _intersects(box, other):
+    for tag in box.keys() & other.keys():
+        minimum, maximum = _bounds(box[tag])
+        otherMin, otherMax = _bounds(other[tag])
+        if max(minimum, otherMin) > min(maximum, otherMax):
+            return False
+    return True
+
+
+def _union(box, other):
+    """Return the condition set matching exactly the locations matched by
+    either box or other, or None if that isn't a single condition set: one
+    must contain the other, or they must only differ on one axis, where
+    their ranges overlap or touch."""
+    if _contains(box, other):
+        return box
+    if _contains(other, box):
+        return other
+    if box.keys() != other.keys():
+        return None
+    different = [tag for tag in box if box[tag] != other[tag]]
+    if len(different) != 1:
+        return None
+    tag = different[0]
+    (minimum, maximum), (otherMin, otherMax) = box[tag], other[tag]
+    bounds, otherBounds = _bounds(box[tag]), _bounds(other[tag])
+    if max(bounds[0], otherBounds[0]) > min(bounds[1], otherBounds[1]):
+        return None
+    result = dict(box)
+    result[tag] = (
+        minimum if bounds[0] <= otherBounds[0] else otherMin,
+        maximum if bounds[1] >= otherBounds[1] else otherMax,
+    )
+    return result
+
+
+def _composeSubstitutions(blocks):
+    """Combine the substitutions of several blocks, each compiled to its own
+    single substitution lookup and applied in order, into one mapping that
+    a single lookup applies with the same result."""
+    mappings = []
+    for subs in blocks:
+        mapping = {}
+        for source, target in subs:
+            mapping.setdefault(source, target)
+        mappings.append(mapping)
+    result = OrderedDict()
+    for mapping in mappings:
+        for glyph in mapping:
+            if glyph in result:
+                continue
+            target = glyph
+            for m in mappings:
+                target = m.get(target, target)
+            result[glyph] = target
+    return [(glyph, target) for glyph, target in result.items() if glyph != target]
+
 
 class VariableRulesWriter(BaseFeatureWriter):
+    """Write the designspace rules as rvrn variation blocks.
+
+    feaLib makes one FeatureVariation record per condition set, and the
+    first record matching a location wins. Identical condition sets are
+    written once, with all their substitutions in a single block; then
+    records with the same substitutions are merged when their condition
+    sets combine into one, and records entirely shadowed by an earlier one
+    are dropped, in both cases only when no record in between could
+    match, so the substitutions applied at every location are unchanged.
+    """
+
+    features = frozenset(["rvrn"])
+    # the kinds of source data this writer reads; see SourceWatcher
+    dependsOn = frozenset(["rules"])
+
     def write(self, font, feaFile, compiler=None):
         """Write features and class definitions for this font to a feaLib
         FeatureFile object.
@@ -17,23 +113,51 @@ class VariableRulesWriter(BaseFeatureWriter):
 
     def _write(self):
         self._designspace = self.context.font
-        self._axis_map = {axis.name: axis.tag for axis in self._designspace.axes}
+        self._masterLocations = getMasterLocations(
+            self._designspace, self.context.compiler
+        )
 
-        feaFile = self.context.feaFile
-        self._conditionsets = []
+        # the substitutions of each rule, grouped by condition set in the
+        # order the condition sets first appear
+        # only substitute glyphs of the compiler's glyph set, which may be
+        # limited to a subset
+        glyphSet = getattr(self.context.compiler, "glyphSet", None)
+        records = OrderedDict()
         for r in self._designspace.rules:
-            conditionsets = [self.rearrangeConditionSet(c) for c in r.conditionSets]
-            for conditionset in conditionsets:
-                if conditionset not in self._conditionsets:
-                    cs_name = "ConditionSet%i" % (len(self._conditionsets) + 1)
-                    feaFile.statements.append(
-                        ast.ConditionsetStatement(cs_name, conditionset)
-                    )
-                    self._conditionsets.append(conditionset)
-                else:
-                    cs_name = "ConditionSet%i" % self._conditionsets.index(conditionset)
+            subs = [tuple(sub) for sub in r.subs]
+            if glyphSet is not None:
+                subs = [
+                    (a, b) for a, b in subs if a in glyphSet and b in glyphSet
+                ]
+            for c in r.conditionSets:
+                conditionset = self.rearrangeConditionSet(c)
+                key = tuple(sorted(conditionset.items()))
+                if key not in records:
+                    records[key] = SimpleNamespace(box=conditionset, blocks=[])
+                records[key].blocks.append(subs)
+        distinct = len(records)
+
+        records = list(records.values())
+        for record in records:
+            record.subs = _composeSubstitutions(record.blocks)
+            if not record.subs and any(record.blocks):
+                # the blocks undo each other; keep them, so that the record
+                # still shadows any later one
+                record.subs = None
+        records = self.mergeConditionSets(records)
+
+        feaFile = self.context.feaFile
+        blocks = 0
+        for i, record in enumerate(records):
+            cs_name = "ConditionSet%i" % (i + 1)
+            feaFile.statements.append(ast.ConditionsetStatement(cs_name, record.box))
+            if record.subs is None:
+                groups = record.blocks
+            else:
+                groups = [record.subs]
+            for subs in groups:
                 block = ast.VariationBlock("rvrn", cs_name)
-                for sub in r.subs:
+                for sub in subs:
                     block.statements.append(
                         ast.SingleSubstStatement(
                             [ast.GlyphName(sub[0])],
@@ -44,9 +168,50 @@ class VariableRulesWriter(BaseFeatureWriter):
                         )
                     )
                 feaFile.statements.append(block)
+                blocks += 1
+
+        stats = getStats(self.context.compiler)
+        if stats is not None:
+            stats.count("rules.conditionSets", len(records))
+            stats.count("rules.conditionSetsMerged", distinct - len(records))
+            stats.count("rules.variationBlocks", blocks)
+
+    @staticmethod
+    def mergeConditionSets(records):
+        """Drop the records whose condition set is contained in an earlier
+        one, and merge records with the same substitutions whose condition
+        sets combine into one, keeping the position of the earlier one."""
+        result = []
+        for record in records:
+            blocked = False
+            for previous in reversed(result):
+                if _contains(previous.box, record.box):
+                    # never matches: an earlier record always wins
+                    break
+                if (
+                    not blocked
+                    and record.subs is not None
+                    and previous.subs is not None
+                    and set(previous.subs) == set(record.subs)
+                ):
+                    union = _union(previous.box, record.box)
+                    if union is not None:
+                        previous.box = union
+                        break
+                if _intersects(previous.box, record.box):
+                    # merging into an earlier record would take precedence
+                    # over this one
+                    blocked = True
+            else:
+                result.append(record)
+        return result
 
     def rearrangeConditionSet(self, condition):
-        return {
-            self._axis_map[rule["name"]]: (rule["minimum"], rule["maximum"])
+        # rule conditions are in designspace coordinates, the conditionset
+        # statement wants userspace
+        return dict(
+            self._masterLocations.userRange(
+                rule["name"], rule["minimum"], rule["maximum"]
+            )
             for rule in condition
-        }
+        )